@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Delta flashing against a known baseline image."""
+
+import random
+from srec import segments_pages
+from Flasher import FlasherException
+
+class DeltaPlan:
+	"""Plan for turning a device holding the baseline image into one
+	holding the new image, erasing and writing as little as possible.
+
+	Pages that differ are found on the host. A block is erased if one of
+	its pages changed from anything but blank, and then all non-blank
+	pages of the new image within it are written. Changed pages that
+	were blank in the baseline are written without an erase."""
+
+	def __init__(self, baseline, image, blocks):
+		self.__baseline = segments_pages(baseline)
+		self.__image = segments_pages(image)
+		self.__blocks = blocks
+		self.__plan()
+
+	def __block(self, page):
+		"""For internal use ONLY!"""
+
+		for block in self.__blocks:
+			if block[0] <= page < block[0] + block[1]:
+				return block
+		raise FlasherException('Page 0x%06x is not within any block.' % page)
+
+	def __plan(self):
+		"""For internal use ONLY!"""
+
+		blank = '\xff' * 256
+		baseline = self.__baseline
+		image = self.__image
+
+		# All pages that differ, in one pass over both page maps.
+		changed = [
+				page for page in set(baseline.keys()) | set(image.keys())
+				if baseline.get(page, blank) != image.get(page, blank)
+				]
+
+		erase = set()
+		write = set()
+		for page in changed:
+			if baseline.get(page, blank) != blank:
+				erase.add(self.__block(page))
+			elif image[page] != blank:
+				write.add(page)
+
+		# Everything of the new image in an erased block is written again.
+		erased = set()
+		for page in image.keys():
+			for block in erase:
+				if block[0] <= page < block[0] + block[1]:
+					erased.add(page)
+					if image[page] != blank:
+						write.add(page)
+					break
+
+		self.__erase = sorted(erase)
+		self.__write = sorted(write)
+		self.__unerased = sorted(write - erased)
+
+	def erase(self):
+		"""The blocks to erase, (address, size)."""
+
+		return self.__erase
+
+	def write(self):
+		"""The pages to write, (address, data)."""
+
+		return [(page, self.__image[page]) for page in self.__write]
+
+	def unerased(self):
+		"""The pages written without an erase, blank in the baseline."""
+
+		return self.__unerased
+
+	def spot_check(self, flasher, count):
+		"""Compare count random baseline pages with the device, and as
+		many of the pages to be written without an erase, which must be
+		blank.
+
+		Raises FlasherException if the device does not hold the baseline."""
+
+		blank = '\xff' * 256
+		pages = [
+				page for page in self.__baseline.keys()
+				if self.__baseline[page] != blank
+				]
+		pages = random.sample(pages, min(count, len(pages)))
+		pages += random.sample(self.__unerased, min(count, len(self.__unerased)))
+
+		for page in sorted(pages):
+			if flasher.page_read(page) != self.__baseline.get(page, blank):
+				raise FlasherException(
+						'Device does not hold the baseline image (page 0x%06x).' % page
+						)
+
+	def run(self, flasher, spot_check=0):
+		"""Erase and write the device according to the plan."""
+
+		if spot_check > 0:
+			self.spot_check(flasher, spot_check)
+
+		for (addr, size) in self.__erase:
+			# Any address in the block will do, use the highest page.
+			flasher.block_erase((addr + size - 1) & 0xffff00)
+
+		for (page, data) in self.write():
+			flasher.page_write(page, data)
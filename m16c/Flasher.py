@@ -25,14 +25,40 @@
 
 import time
 import struct
+import collections
 
 class FlasherException(Exception):
 	"""Base class for Flasher exceptions."""
 
+# Flash blocks (address, size) of the 64K user ROM area found on every
+# M16C/62P, larger parts have additional 64K blocks below 0x0f0000.
+M16C62P_BLOCKS = [
+	(0x0f0000, 0x8000), # Block 5
+	(0x0f8000, 0x2000), # Block 4
+	(0x0fa000, 0x2000), # Block 3
+	(0x0fc000, 0x2000), # Block 2
+	(0x0fe000, 0x1000), # Block 1
+	(0x0ff000, 0x1000), # Block 0
+	]
+
+# Seconds to program a page, the status of a page write is held back
+# until it is done.
+PAGE_WRITE_TIME = 0.05
+
 class Flasher:
-	def __init__(self, device, clock_validated=False):
+	def __init__(self, device, clock_validated=False, retries=0, retry_delay=0.1):
 		self.__device = device
 		self.__clock_validated = clock_validated
+		self.__retries = retries
+		self.__retry_delay = retry_delay
+		self.__retry_count = {'page_read': 0, 'page_write': 0, 'page_batch': 0}
+		self.__blocks = M16C62P_BLOCKS
+		self.__timeout_margin = None
+		self.__timeout_erase = 0.0
+		self.__timeout = None
+		self.__cache = collections.OrderedDict()
+		self.__cache_size = 0
+		self.__cache_hits = 0
 		self.__STATUS_OK            = 'Ok'
 		self.__STATUS_WRITE_FAILED  = 'Write failed'
 		self.__STATUS_PAGE_LOCKED   = 'Page locked'
@@ -81,6 +107,76 @@ class Flasher:
 			else:
 				break
 
+	def __read(self, size=1, slack=0.0, sent=0):
+		"""For internal use ONLY!"""
+
+		# Give the device the time it takes to send the reply at the
+		# current baud rate (10 bits per byte) plus the margin. Writes
+		# return before the bytes are on the line, so the sent bytes
+		# still to go out are added as well.
+		if self.__timeout_margin != None:
+			timeout = (sent + size) * 10.0 / self.__device.getBaudrate()
+			timeout += self.__timeout_margin + slack
+			if timeout != self.__timeout:
+				self.__device.setTimeout(timeout)
+				self.__timeout = timeout
+
+		return self.__device.read(size)
+
+	def __resync(self):
+		"""For internal use ONLY!"""
+
+		# Throw away whatever is left of the failed transfer and clear
+		# the error bits before we try again.
+		if hasattr(self.__device, 'flushInput'):
+			self.__device.flushInput()
+		self.status_clear()
+
+	def __retry(self, name, function, *args):
+		"""For internal use ONLY!"""
+
+		attempt = 0
+		while True:
+			try:
+				return function(*args)
+			except FlasherException:
+				if attempt >= self.__retries:
+					raise
+
+			# Back off, doubling the delay for each attempt, then
+			# resynchronise and retry.
+			time.sleep(self.__retry_delay * (2 ** attempt))
+			attempt += 1
+			self.__retry_count[name] += 1
+			try:
+				self.__resync()
+			except FlasherException:
+				# Still out of sync, the next attempt will tell.
+				pass
+
+	def __cache_get(self, addr):
+		"""For internal use ONLY!"""
+
+		page = self.__cache.pop(addr, None)
+		if page != None:
+			# Most recently used pages are kept at the end.
+			self.__cache[addr] = page
+			self.__cache_hits += 1
+		return page
+
+	def __cache_put(self, addr, page):
+		"""For internal use ONLY!"""
+
+		if self.__cache_size == 0:
+			return
+
+		self.__cache.pop(addr, None)
+		self.__cache[addr] = page
+
+		# Evict the least recently used pages.
+		while len(self.__cache) > self.__cache_size:
+			self.__cache.popitem(last=False)
+
 	def __status_flash_error(self, status):
 		"""For internal use ONLY!"""
 
@@ -99,7 +195,7 @@ class Flasher:
 		if (status & 0x04) == 0x04:
 			return self.__STATUS_WRITE_FAILED
 	
-	def clock_validate(self):
+	def clock_validate(self, interval=0.02):
 
 		# Note, __sanity does not work here...
 		if self.__clock_validated:
@@ -110,27 +206,68 @@ class Flasher:
 		# validation failed error.".
 		#
 		# Detection and patch courtesy of Henrik Mäkitaavola
-		self.__device.read()
+		self.__read()
 
 		zero = struct.pack("B", 0x00)
 		cmd_clock = struct.pack("B", 0xb0)
 		self.__device.write(cmd_clock)
-		if self.__device.read() != cmd_clock:
+		if self.__read() != cmd_clock:
 			raise FlasherException(
 					'Could not connect: Clock validation failed.'
 					)
 
+		# The zeros are sent at a fixed interval measured from the
+		# first one, the time spent writing is not added on top. The
+		# reply is read with a timeout so no wait after the last one.
+		# The 20ms default is the interval this has always used, it
+		# has not been measured how short the boot loader accepts.
+		start = time.time()
 		for i in range(16):
 			self.__device.write(zero)
-			time.sleep(0.02)
+			if i != 15:
+				time.sleep(max(0, start + (i+1)*interval - time.time()))
 
-		if self.__device.read() != cmd_clock:
+		if self.__read() != cmd_clock:
 			raise FlasherException(
 					'Could not connect: Clock validation failed.'
 					)
 
 		self.__clock_validated = True
 
+	def clock_probe(self, baud, margin=0.1):
+		"""Check if the device is already synchronised at the baud rate.
+
+		Asks for the version at the baud rate, if the boot loader
+		answers the clock is validated and the baud rate kept, otherwise
+		the baud rate is restored and clock_validate() is needed."""
+
+		# Note, __sanity does not work here...
+		if self.__clock_validated:
+			raise FlasherException('Clock already validated.')
+
+		if not baud in [9600, 19200, 38400, 57600]:
+			raise FlasherException('Invalid baud rate.')
+
+		saved_baud = self.__device.getBaudrate()
+		saved_timeout = self.__device.getTimeout()
+		self.__device.setBaudrate(baud)
+		self.__device.setTimeout(8 * 10.0 / baud + margin)
+		try:
+			if hasattr(self.__device, 'flushInput'):
+				self.__device.flushInput()
+			self.__device.write(struct.pack("B", 0xfb))
+			version = self.__device.read(8)
+		finally:
+			self.__device.setTimeout(saved_timeout)
+			self.__timeout = None
+
+		if len(version) == 8 and version[:4] == 'VER.':
+			self.__clock_validated = True
+			return True
+
+		self.__device.setBaudrate(saved_baud)
+		return False
+
 	def clock_validated(self):
 
 		return self.__clock_validated
@@ -163,7 +300,7 @@ class Flasher:
 			raise FlasherException('Invalid baudrate specified.')
 
 		self.__device.write(cmd_baud_set)
-		if self.__device.read() != cmd_baud_set:
+		if self.__read() != cmd_baud_set:
 			raise FlasherException('Set baudrate failed.')
 		self.__device.setBaudrate(baud)
 
@@ -203,9 +340,14 @@ class Flasher:
 
 		self.__sanity(id_validation=False, clock_validation=True)
 
+		return self.__status_read()
+
+	def __status_read(self, slack=0.0, sent=0):
+		"""For internal use ONLY!"""
+
 		cmd_status_read = struct.pack("B", 0x70)
 		self.__device.write(cmd_status_read)
-		status = self.__device.read(2)
+		status = self.__read(2, slack, sent + len(cmd_status_read))
 		if len(status) != 2:
 			# NOTE: bug (found 2010-07-20) in pyserial causing
 			# timeout time to sometimes (Linux) be interpreted as
@@ -228,7 +370,7 @@ class Flasher:
 
 		cmd_version_read = struct.pack("B", 0xfb)
 		self.__device.write(cmd_version_read)
-		version = self.__device.read(8)
+		version = self.__read(8)
 		return version
 
 	def lock_enable(self):
@@ -250,26 +392,54 @@ class Flasher:
 		# TODO: Check result of command
 
 	def program_run(self, data):
+		"""Download a program to RAM and run it.
+
+		There is no reply once the program runs, a rejected download is
+		only seen by the boot loader still answering, see stub_load()."""
 
 		self.__sanity(id_validation=True, clock_validation=True)
 
-		raise FlasherException('Loading program to RAM not yet supported.')
+		if len(data) == 0 or len(data) > 0xffff:
+			raise FlasherException('Invalid program size (%d).' % len(data))
+
+		# Clear the status so that the checksum bit is that of this
+		# download.
+		self.__status_ready_wait()
+		self.status_clear()
+
+		checksum = sum(bytearray(data)) & 0xff
+		cmd_program_run = struct.pack(
+				"BBBB",
+				0xfa,
+				len(data) & 0xff,
+				(len(data) >> 8) & 0xff,
+				checksum
+				)
+		self.__device.write(cmd_program_run)
+		self.__device.write(data)
 
-		#if len(data) > 0xffff:
-		#	raise FlasherException('Program too large (>0xffff).')
+	def stub_load(self, data, protocol):
+		"""Run a program from RAM and return the protocol talking to it.
 
-		#checksum = 0
-		#cmd_program_run = struct.pack(
-		#		"BBBB",
-		#		0xfa,
-		#		len(data) & 0xff,
-		#		(len(data) >> 8) & 0xff,
-		#		checksum
-		#		)
-		#self.__device.write(cmd_program_run)
-		#self.__device.write(data)
+		The protocol is a StubProtocol class, once connected it replaces
+		the boot loader for writing the flash."""
 
-		# TODO: Check result of command
+		self.program_run(data)
+
+		stub = protocol(self.__device)
+		try:
+			stub.connect()
+		except FlasherException:
+			# If the boot loader still answers it refused the program.
+			try:
+				status = self.__status_read()
+			except FlasherException:
+				raise FlasherException('RAM program not responding.')
+			if not self.__status_check_ok(status):
+				raise FlasherException('RAM program rejected: Checksum mismatch.')
+			raise FlasherException('RAM program not started.')
+
+		return stub
 
 	def boot_read(self, addr):
 
@@ -282,7 +452,7 @@ class Flasher:
 				(addr >> 16) & 0xff
 				)
 		self.__device.write(cmd_page_read)
-		page = self.__device.read(256)
+		page = self.__read(256)
 		if len(page) != 256:
 			raise FlasherException(
 					'Unable to read boot page: Timeout or insufficient data (%d).' % len(page)
@@ -295,10 +465,67 @@ class Flasher:
 
 		return page
 
+	def retry_set(self, retries, retry_delay=0.1):
+
+		if retries < 0:
+			raise FlasherException('Invalid number of retries (%d).' % retries)
+
+		self.__retries = retries
+		self.__retry_delay = retry_delay
+
+	def timeout_set(self, margin, erase=5.0):
+		"""Derive the timeout of each read from the baud rate and size.
+
+		The margin (seconds) is added to the time the reply takes on the
+		line, and erase on top of that when waiting for an erase to
+		finish. A margin of None keeps the timeout of the device."""
+
+		if margin != None and (margin < 0 or erase < 0):
+			raise FlasherException('Invalid timeout margin.')
+
+		self.__timeout_margin = margin
+		self.__timeout_erase = erase
+		self.__timeout = None
+
+	def cache_set(self, size):
+		"""Keep up to size pages read or written in this session.
+
+		Reads of cached pages never reach the device. Writes and erases
+		update the cache as they go, which assumes that nothing but this
+		flasher changes the flash. A size of 0 disables the cache."""
+
+		if size < 0:
+			raise FlasherException('Invalid page cache size (%d).' % size)
+
+		self.__cache_size = size
+		while len(self.__cache) > size:
+			self.__cache.popitem(last=False)
+
+	def cache_hits(self):
+		"""Number of page reads served from the cache so far."""
+
+		return self.__cache_hits
+
+	def retry_count(self):
+		"""Number of retries performed so far, by operation."""
+
+		return self.__retry_count.copy()
+
 	def page_read(self, addr):
 
 		self.__sanity(id_validation=True, clock_validation=True)
 
+		addr &= 0xffff00
+		page = self.__cache_get(addr)
+		if page == None:
+			page = self.__retry('page_read', self.__page_read, addr)
+			self.__cache_put(addr, page)
+
+		return page
+
+	def __page_read(self, addr):
+		"""For internal use ONLY!"""
+
 		self.__status_ready_wait()
 
 		cmd_page_read = struct.pack(
@@ -308,7 +535,7 @@ class Flasher:
 				(addr >> 16) & 0xff
 				)
 		self.__device.write(cmd_page_read)
-		page = self.__device.read(256)
+		page = self.__read(256)
 		if len(page) != 256:
 			raise FlasherException(
 					'Unable to read page: Timeout or insufficient data (%d).' % len(page)
@@ -322,15 +549,132 @@ class Flasher:
 
 		return page
 
-	def page_write(self, addr, data):
+	def pages_read(self, addrs, batch=8):
+		"""Read pages, sending up to batch page reads back to back.
+
+		Yields (address, page) in the order of the addresses. The status
+		is checked once per batch, if a batch fails it is read again one
+		page at a time and so is everything after it."""
 
 		self.__sanity(id_validation=True, clock_validation=True)
 
+		if batch < 1:
+			raise FlasherException('Invalid batch size (%d).' % batch)
+
+		return self.__pages_read(addrs, batch, True)
+
+	def __pages_read(self, addrs, batch, cached):
+		"""For internal use ONLY!"""
+
+		addrs = [i & 0xffff00 for i in addrs]
+		i = 0
+		while i < len(addrs):
+			if cached:
+				page = self.__cache_get(addrs[i])
+				if page != None:
+					yield (addrs[i], page)
+					i += 1
+					continue
+
+			# Up to the next cached page, those are already in order.
+			chunk = list()
+			while i < len(addrs) and len(chunk) < batch:
+				if cached and addrs[i] in self.__cache:
+					break
+				chunk.append(addrs[i])
+				i += 1
+
+			pages = None
+			if len(chunk) > 1:
+				try:
+					pages = self.__page_batch(chunk)
+				except FlasherException:
+					# The boot loader did not keep up, go lock-step.
+					self.__retry_count['page_batch'] += 1
+					batch = 1
+					self.__batch_resync(len(chunk))
+
+			if pages == None:
+				pages = [
+						self.__retry('page_read', self.__page_read, addr)
+						for addr in chunk
+						]
+
+			for (addr, page) in zip(chunk, pages):
+				if cached:
+					self.__cache_put(addr, page)
+				yield (addr, page)
+
+	def __batch_resync(self, count):
+		"""For internal use ONLY!"""
+
+		# The boot loader may still be sending the rest of the batch,
+		# let it finish before throwing it away.
+		time.sleep(count * 258 * 10.0 / self.__device.getBaudrate() + self.__retry_delay)
+		self.__resync()
+
+		# Anything left of the batch would be taken for the next reply,
+		# make sure the reply we get is the one we asked for.
+		self.__device.write(struct.pack("B", 0xfb))
+		if self.__read(8)[:4] != 'VER.':
+			raise FlasherException('Unable to resynchronise after a failed read batch.')
+
+	def __page_batch(self, addrs):
+		"""For internal use ONLY!"""
+
 		self.__status_ready_wait()
 
+		self.__device.write(''.join([
+				struct.pack("BBB", 0xff, (addr >> 8) & 0xff, (addr >> 16) & 0xff)
+				for addr in addrs
+				]))
+
+		# The pages are read as they come in, they are checked against
+		# the status of the whole batch.
+		pages = list()
+		for addr in addrs:
+			page = self.__read(256)
+			if len(page) != 256:
+				raise FlasherException(
+						'Unable to read page: Timeout or insufficient data (%d).' % len(page)
+						)
+			pages.append(page)
+
+		status = self.status_read()
+		if not self.__status_flash_ok(status):
+			raise FlasherException(
+					'Reading pages 0x%06x-0x%06x failed: \'%s\'.' %
+					(addrs[0], addrs[-1], self.__status_flash_error(status))
+					)
+
+		return pages
+
+	def page_write(self, addr, data):
+
+		self.__sanity(id_validation=True, clock_validation=True)
+
 		if len(data) > 256:
 			raise FlasherException('Invalid page size (%d != 256).' % len(data))
 
+		self.__retry('page_write', self.__page_write, addr, data)
+
+		# Programming can only clear bits, the page ends up as the old
+		# content and the data combined. Without the old content (cached
+		# or erased) the result is unknown.
+		addr &= 0xffff00
+		page = self.__cache.get(addr)
+		if len(data) == 256 and page != None:
+			self.__cache_put(addr, str(bytearray(
+					[a & b for (a, b) in zip(bytearray(page), bytearray(data))]
+					)))
+		else:
+			self.__cache.pop(addr, None)
+
+	def __page_write(self, addr, data):
+		"""For internal use ONLY!"""
+
+		self.__status_ready_wait()
+
 		cmd_page_write = struct.pack(
 				"BBB",
 				0x41,
@@ -340,7 +684,11 @@ class Flasher:
 		self.__device.write(cmd_page_write)
 		self.__device.write(data)
 
-		status = self.status_read()
+		# The reply waits for the command and data to go out and the
+		# page to be programmed.
+		status = self.__status_read(
+				PAGE_WRITE_TIME, len(cmd_page_write) + len(data)
+				)
 		if not self.__status_flash_ok(status):
 			raise FlasherException(
 					'Write to page 0x%06x failed: \'%s\'.' % (addr & 0xffff00, self.__status_flash_error(status))
@@ -361,12 +709,24 @@ class Flasher:
 				)
 		self.__device.write(cmd_block_erase)
 
-		status = self.status_read()
-		if not self.__status_flash_ok(self.status_read()):
+		# The reply is held back until the erase is done.
+		status = self.__status_read(self.__timeout_erase)
+		if not self.__status_flash_ok(status):
 			raise FlasherException(
 					'Block erase failed: \'%s\'.' % self.__status_flash_error(status)
 					)
 
+		# The whole block is blank now, without knowing the extent of the
+		# block nothing cached can be trusted.
+		blank = '\xff' * 256
+		for (lower, size) in self.__blocks:
+			if lower <= addr < lower + size:
+				for page in range(lower, lower + size, 0x100):
+					self.__cache_put(page, blank)
+				break
+		else:
+			self.__cache.clear()
+
 	def block_erase_all(self):
 
 		self.__sanity(id_validation=True, clock_validation=True)
@@ -380,12 +740,71 @@ class Flasher:
 				)
 		self.__device.write(cmd_block_erase)
 
-		status = self.status_read()
-		if not self.__status_flash_ok(self.status_read()):
+		# The reply is held back until the erase is done.
+		status = self.__status_read(self.__timeout_erase)
+		if not self.__status_flash_ok(status):
 			raise FlasherException(
 					'Erase all blocks failed: \'%s\'.' % self.__status_flash_error(status)
 					)
 
+		# Locked blocks are left as they are, so forget everything.
+		self.__cache.clear()
+
+	def blocks_set(self, blocks):
+		"""Set the flash block layout, a list of (address, size)."""
+
+		for (addr, size) in blocks:
+			if addr & 0xff or size <= 0 or size & 0xff:
+				raise FlasherException(
+						'Invalid block 0x%06x:0x%x, blocks must be page aligned.' % (addr, size)
+						)
+		self.__blocks = list(blocks)
+
+	def blocks(self):
+
+		return self.__blocks
+
+	def block_blank(self, addr, size, sample=1):
+		"""Check if a block is erased by reading every sample:th page."""
+
+		if sample < 1:
+			raise FlasherException('Invalid blank check sample (%d).' % sample)
+
+		first = addr & 0xffff00
+		last = (addr + size - 1) & 0xffff00
+		pages = range(first, last + 0x100, 0x100 * sample)
+
+		# The last page is always checked, it is the one most likely
+		# to hold data (vectors, id codes etc.).
+		if pages[-1] != last:
+			pages.append(last)
+
+		for page in pages:
+			if self.page_read(page) != '\xff' * 256:
+				return False
+		return True
+
+	def block_erase_check(self, addr, size, sample=1):
+		"""Erase a block unless it is already blank, True if erased."""
+
+		if self.block_blank(addr, size, sample):
+			return False
+
+		# Any address in the block will do, use the highest page.
+		self.block_erase((addr + size - 1) & 0xffff00)
+		return True
+
+	def blocks_erase(self, sample=1):
+		"""Erase all blocks of the layout that are not blank.
+
+		Returns the number of blocks that were erased."""
+
+		erased = 0
+		for (addr, size) in self.__blocks:
+			if self.block_erase_check(addr, size, sample):
+				erased += 1
+		return erased
+
 	def segment_write(self, segment):
 		"""Write a segment (address+data) to the device."""
 
@@ -428,3 +847,24 @@ class Flasher:
 
 		if sent != len(segment[1]):
 			raise FlasherException('Failed to write all data? (BUG!)')
+
+	def segment_verify(self, segment, batch=1):
+		"""Read back a segment (address+data) and compare it, reading up
+		to batch pages back to back."""
+
+		self.__sanity(id_validation=True, clock_validation=True)
+
+		if batch < 1:
+			raise FlasherException('Invalid batch size (%d).' % batch)
+
+		addr = segment[0]
+		data = segment[1]
+		pages = range(addr & 0xffff00, addr + len(data), 0x100)
+
+		# Always read the device, the cache holds what we believe was
+		# written.
+		for (page, tmp) in self.__pages_read(pages, batch, False):
+			start = max(addr, page)
+			end = min(addr + len(data), page + 0x100)
+			if tmp[start-page:end-page] != data[start-addr:end-addr]:
+				raise FlasherException('Verify failed at page 0x%06x.' % page)
@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""Running flash jobs on a pool of serial ports.
+
+Every port has a worker thread taking jobs from a shared queue, so a port
+starts on the next job as soon as it is done with the last one. A job is
+one line:
+
+	program <image>                  erase all, write the image
+	verify <image>                   compare the device with the image
+	dump <output> <addr:size> ...    read the ranges to a flash dump
+
+Images are parsed the first time a job uses them and shared by all
+ports. A failed program job is retried on another port, a failed verify
+or dump job is not since it is about the unit on the port it ran on. A
+port failing too many jobs in a row is taken out of the pool."""
+
+import time, threading, Queue
+import srec
+from Flasher import Flasher
+
+JOB_KINDS = ('program', 'verify', 'dump')
+
+class JobException(Exception):
+	"""Base class for job exceptions."""
+
+class Job:
+	"""A job, as parsed from a line by job_parse."""
+
+	def __init__(self, number, kind, path, ranges=()):
+		self.number = number
+		self.kind = kind
+		self.path = path
+		self.ranges = ranges
+		self.queued = time.time()
+		self.started = None
+		self.attempts = 0
+		self.ports = list()
+
+	def __str__(self):
+		return 'Job %d (%s %s)' % (self.number, self.kind, self.path)
+
+def job_parse(number, line):
+	"""Parse a job line, None for empty lines and comments."""
+
+	fields = line.split()
+	if len(fields) == 0 or fields[0].startswith('#'):
+		return None
+
+	if not fields[0] in JOB_KINDS:
+		raise JobException('Invalid job \'%s\'.' % fields[0])
+	if len(fields) < 2:
+		raise JobException('No file given for the %s job.' % fields[0])
+
+	ranges = list()
+	if fields[0] == 'dump':
+		if len(fields) < 3:
+			raise JobException('No address range given for the dump job.')
+		for i in fields[2:]:
+			try:
+				(addr, size) = [int(j, 0) for j in i.split(':')]
+			except ValueError:
+				raise JobException('Invalid address range \'%s\'.' % i)
+			if size <= 0:
+				raise JobException('Invalid address range \'%s\'.' % i)
+			ranges.append((addr, size))
+	elif len(fields) != 2:
+		raise JobException('Too many fields for the %s job.' % fields[0])
+
+	return Job(number, fields[0], fields[1], ranges)
+
+class JobScheduler:
+	"""Class running jobs on a pool of serial ports.
+
+	device_open(port) opens the serial device of a port, it stays open
+	while the port is in the pool. Every job starts with a fresh boot
+	loader connection: clock validation, baud rate and id validation."""
+
+	def __init__(self, ports, device_open, device_id, baud=9600,
+			max_failures=3, job_retries=1, log=None):
+		self.__ports = ports
+		self.__device_open = device_open
+		self.__device_id = device_id
+		self.__baud = baud
+		self.__max_failures = max_failures
+		self.__job_retries = job_retries
+		self.__log = log
+
+		self.__queue = Queue.Queue()
+		self.__lock = threading.Lock()
+		self.__done = threading.Condition(self.__lock)
+		self.__stop = False
+		self.__jobs = 0
+		self.__pending = 0
+		self.__images = dict()
+		self.__image_locks = dict()
+
+		# Metrics, per port [jobs, failed jobs, busy seconds, healthy].
+		self.__start = None
+		self.__finished = list()
+		self.__failed = list()
+		self.__port_stats = dict([(i, [0, 0, 0.0, True]) for i in ports])
+
+		self.__workers = list()
+
+	def __message(self, text):
+		"""For internal use ONLY!"""
+
+		if self.__log != None:
+			self.__lock.acquire()
+			try:
+				self.__log(text)
+			finally:
+				self.__lock.release()
+
+	def __image(self, path):
+		"""For internal use ONLY!"""
+
+		# One lock per image so that an image is parsed once, while
+		# other ports keep loading other images.
+		self.__lock.acquire()
+		try:
+			lock = self.__image_locks.setdefault(path, threading.Lock())
+		finally:
+			self.__lock.release()
+
+		lock.acquire()
+		try:
+			if not path in self.__images:
+				self.__images[path] = srec.image_open(path).segments()
+			return self.__images[path]
+		finally:
+			lock.release()
+
+	def __connect(self, device):
+		"""For internal use ONLY!"""
+
+		# A new unit always starts out at 9600 baud.
+		device.setBaudrate(9600)
+		if hasattr(device, 'flushInput'):
+			device.flushInput()
+
+		flasher = Flasher(device)
+		flasher.clock_validate()
+		flasher.baud_set(self.__baud)
+		flasher.id_validate(self.__device_id)
+		return flasher
+
+	def __run(self, device, job, segments):
+		"""For internal use ONLY!"""
+
+		if job.kind == 'dump':
+			flasher = self.__connect(device)
+			file = open(job.path, 'wb')
+			try:
+				writer = srec.DumpWriter(file)
+				for (addr, size) in job.ranges:
+					end = addr + size
+					while addr < end:
+						page = flasher.page_read(addr)
+						upper = min(end, (addr & 0xffff00) + 0x100)
+						writer.write(addr, page[addr & 0xff:(addr & 0xff) + upper - addr])
+						addr = upper
+				writer.close()
+			finally:
+				file.close()
+			return
+
+		flasher = self.__connect(device)
+		if job.kind == 'program':
+			flasher.block_erase_all()
+			for i in segments:
+				flasher.segment_write(i)
+		else:
+			for i in segments:
+				flasher.segment_verify(i)
+
+	def __finish(self, job, error=None):
+		"""For internal use ONLY!"""
+
+		self.__lock.acquire()
+		try:
+			if error == None:
+				self.__finished.append((job, time.time()))
+			else:
+				self.__failed.append((job, error))
+			self.__pending -= 1
+			self.__done.notifyAll()
+		finally:
+			self.__lock.release()
+
+	def __worker(self, port):
+		"""For internal use ONLY!"""
+
+		stats = self.__port_stats[port]
+		failures = 0
+		try:
+			device = self.__device_open(port)
+		except Exception, (error):
+			self.__message('%s: Unable to open: %s' % (port, error))
+			stats[3] = False
+			return
+
+		try:
+			while not self.__stop:
+				try:
+					job = self.__queue.get(True, 0.1)
+				except Queue.Empty:
+					continue
+
+				# Leave a failed job to the ports that have not tried it,
+				# unless this is the only healthy port left to try.
+				if port in job.ports and len([
+						i for i in self.healthy() if not i in job.ports
+						]) != 0:
+					self.__queue.put(job)
+					time.sleep(0.1)
+					continue
+
+				job.attempts += 1
+				start = time.time()
+				if job.attempts == 1:
+					job.started = start
+
+				# Parse the image before connecting, a broken image is
+				# not the fault of the port nor fixed by retrying.
+				segments = None
+				if job.kind != 'dump':
+					try:
+						segments = self.__image(job.path)
+					except Exception, (error):
+						self.__message('%s: %s failed: %s' % (port, job, error))
+						self.__finish(job, str(error))
+						continue
+
+				try:
+					self.__run(device, job, segments)
+				except Exception, (error):
+					stats[1] += 1
+					stats[2] += time.time() - start
+					failures += 1
+					job.ports.append(port)
+					self.__message('%s: %s failed: %s' % (port, job, error))
+					if job.kind != 'program' or job.attempts > self.__job_retries:
+						self.__finish(job, str(error))
+					else:
+						self.__queue.put(job)
+
+					if failures >= self.__max_failures:
+						self.__message('%s: Unhealthy, removed from the pool.' % port)
+						stats[3] = False
+						return
+					continue
+
+				failures = 0
+				stats[0] += 1
+				stats[2] += time.time() - start
+				self.__message('%s: %s done (%.1fs).' % (port, job, time.time() - start))
+				self.__finish(job)
+		finally:
+			if hasattr(device, 'close'):
+				device.close()
+
+			# Let anyone waiting know that there is one port less.
+			self.__lock.acquire()
+			try:
+				self.__done.notifyAll()
+			finally:
+				self.__lock.release()
+
+	def start(self):
+		"""Start a worker for each port."""
+
+		self.__start = time.time()
+		for port in self.__ports:
+			worker = threading.Thread(target=self.__worker, args=(port,))
+			worker.setDaemon(True)
+			worker.start()
+			self.__workers.append(worker)
+
+	def submit(self, line):
+		"""Queue the job of a line, returns the job or None if the line
+		holds no job."""
+
+		self.__lock.acquire()
+		try:
+			job = job_parse(self.__jobs + 1, line)
+			if job == None:
+				return None
+			self.__jobs += 1
+			self.__pending += 1
+		finally:
+			self.__lock.release()
+
+		self.__queue.put(job)
+		return job
+
+	def wait(self):
+		"""Wait until every queued job is done or failed, or until no port
+		is left. Returns the number of jobs that never ran."""
+
+		self.__lock.acquire()
+		try:
+			while self.__pending > 0:
+				if len([i for i in self.__workers if i.isAlive()]) == 0:
+					break
+				self.__done.wait(0.5)
+		finally:
+			self.__lock.release()
+
+		# Without any ports left the rest of the queue fails.
+		lost = 0
+		while True:
+			try:
+				job = self.__queue.get(False)
+			except Queue.Empty:
+				break
+			self.__finish(job, 'No healthy port left.')
+			lost += 1
+		return lost
+
+	def stop(self):
+		"""Stop the workers once they are done with their current job."""
+
+		self.__stop = True
+		for worker in self.__workers:
+			worker.join()
+
+	def healthy(self):
+		"""The ports still in the pool."""
+
+		return [i for i in self.__ports if self.__port_stats[i][3]]
+
+	def metrics(self):
+		"""Throughput and queue latency so far, as a dictionary."""
+
+		self.__lock.acquire()
+		try:
+			elapsed = 0.0
+			if self.__start != None:
+				elapsed = time.time() - self.__start
+			latency = [job.started - job.queued for (job, end) in self.__finished]
+
+			metrics = {
+					'jobs': self.__jobs,
+					'done': len(self.__finished),
+					'failed': len(self.__failed),
+					'pending': self.__pending,
+					'elapsed': elapsed,
+					'throughput': 0.0,
+					'latency_mean': 0.0,
+					'latency_max': 0.0,
+					'ports': dict(),
+					}
+			if elapsed > 0:
+				metrics['throughput'] = len(self.__finished) * 3600.0 / elapsed
+			if len(latency) != 0:
+				metrics['latency_mean'] = sum(latency) / len(latency)
+				metrics['latency_max'] = max(latency)
+			for (port, (jobs, failed, busy, healthy)) in self.__port_stats.items():
+				utilisation = 0.0
+				if elapsed > 0:
+					utilisation = busy / elapsed
+				metrics['ports'][port] = {
+						'jobs': jobs,
+						'failed': failed,
+						'utilisation': utilisation,
+						'healthy': healthy,
+						}
+			return metrics
+		finally:
+			self.__lock.release()
+
+def metrics_report(metrics):
+	"""Text report of JobScheduler.metrics()."""
+
+	lines = [
+			'Jobs: %d done, %d failed, %d pending.' %
+			(metrics['done'], metrics['failed'], metrics['pending']),
+			'Throughput: %.1f jobs/hour over %.1fs.' %
+			(metrics['throughput'], metrics['elapsed']),
+			'Queue latency: %.2fs mean, %.2fs max.' %
+			(metrics['latency_mean'], metrics['latency_max']),
+			'%-16s %8s %8s %8s %8s' % ('Port', 'Jobs', 'Failed', 'Busy', 'Healthy'),
+			]
+	for port in sorted(metrics['ports'].keys()):
+		stats = metrics['ports'][port]
+		lines.append('%-16s %8d %8d %7.0f%% %8s' % (
+				port,
+				stats['jobs'],
+				stats['failed'],
+				stats['utilisation'] * 100,
+				('no', 'yes')[stats['healthy']]
+				))
+	return '\n'.join(lines) + '\n'
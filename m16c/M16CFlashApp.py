@@ -22,7 +22,7 @@
 
 """Serial line flasher application for m16c microcontrollers."""
 
-import serial, m16c, struct, sys, time, srec
+import serial, m16c, struct, sys, time, srec, json
 from optparse import OptionParser, SUPPRESS_HELP
 
 class M16CFlashApp:
@@ -59,6 +59,41 @@ There is NO WARRANTY, to the extent permitted by law.""")
 				default=5,
 				help='Timeout in seconds for serial communication (default: 5).'
 				)
+		parser.add_option(
+				'--timeout-margin',
+				dest='timeout_margin',
+				type='float',
+				help='Derive the timeout of each read from the baud rate and size of the reply, plus this margin in seconds (e.g. 0.05). ' +
+				'Erases still get --timeout.'
+				)
+		parser.add_option(
+				'--low-latency',
+				dest='low_latency',
+				action='store_true',
+				default=False,
+				help='Put the serial port in low latency mode (Linux), for USB serial adapters.'
+				)
+		parser.add_option(
+				'--inter-byte-timeout',
+				dest='inter_byte_timeout',
+				type='float',
+				help='Give up on a reply once no byte has arrived for this many seconds.'
+				)
+		parser.add_option(
+				'--fast-connect',
+				dest='fast_connect',
+				action='store_true',
+				default=False,
+				help='Check if the device is already synchronised at the baud rate before validating the clock.'
+				)
+		parser.add_option(
+				'--sync-interval',
+				dest='sync_interval',
+				type='float',
+				default=0.02,
+				help=SUPPRESS_HELP
+				#help='Interval between the zeros sent when validating the clock, shorter intervals are untested (default: 0.02s).'
+				)
 		parser.add_option(
 				'--device-id',
 				dest='device_id',
@@ -95,7 +130,30 @@ There is NO WARRANTY, to the extent permitted by law.""")
 				'-i', '--input-file',
 				dest='input_file',
 				type='string',
-				help='The input file for the operation.'
+				action='append',
+				help='The input file for the operation, several files are combined into one image.'
+				)
+		parser.add_option(
+				'--manifest',
+				dest='manifest',
+				type='string',
+				help='File listing the input files, one \'path [format [base address]]\' per line.'
+				)
+		parser.add_option(
+				'-f', '--format',
+				dest='format',
+				type='choice',
+				choices=srec.IMAGE_FORMATS,
+				default='auto',
+				help='Format of the input file: ' + ', '.join(srec.IMAGE_FORMATS) +
+				' (default: auto).'
+				)
+		parser.add_option(
+				'--base-address',
+				dest='base_address',
+				type='int',
+				default=0,
+				help='Address of the first byte of a raw binary input file (default: 0).'
 				)
 		parser.add_option(
 				'-o', '--output-file',
@@ -104,6 +162,37 @@ There is NO WARRANTY, to the extent permitted by law.""")
 				help=SUPPRESS_HELP
 				#help='The output file for the operation.'
 				)
+		parser.add_option(
+				'--publish',
+				dest='publish',
+				type='string',
+				help='Do not use the device, parse the input file(s) once and publish them as a shared image file (e.g. in /dev/shm) for other processes to use as input.'
+				)
+		parser.add_option(
+				'--jobs',
+				dest='jobs',
+				type='int',
+				default=1,
+				help='Number of processes parsing S-Record files of 4MB or more, 0 for one per cpu. ' +
+				'The records are sent back from each process, which may well cost more than it saves (default: 1).'
+				)
+		parser.add_option(
+				'--srec-index',
+				dest='srec_index',
+				action='store_true',
+				default=False,
+				help=SUPPRESS_HELP
+				#help='Only write the --address range(s) of the input file, using a sidecar index (<input file>.idx). --flash-program only erases the blocks the range(s) are in.'
+				)
+		parser.add_option(
+				'--output-format',
+				dest='output_format',
+				type='choice',
+				choices=['raw', 'dump', 'srec'],
+				default='raw',
+				help=SUPPRESS_HELP
+				#help='Format of the output file, raw, dump (sparse compressed flash dump) or srec.'
+				)
 		parser.add_option(
 				'--reset-pin',
 				dest='reset_pin',
@@ -116,6 +205,141 @@ There is NO WARRANTY, to the extent permitted by law.""")
 				type='float',
 				help='How long should we hold the reset low (default: 0.1s).'
 				)
+		parser.add_option(
+				'--retries',
+				dest='retries',
+				type='int',
+				default=0,
+				help='How many times a failed page read or write is retried (default: 0).'
+				)
+		parser.add_option(
+				'--retry-delay',
+				dest='retry_delay',
+				type='float',
+				default=0.1,
+				help='Delay before the first retry, doubled for each attempt (default: 0.1s).'
+				)
+		parser.add_option(
+				'--page-cache',
+				dest='page_cache',
+				type='int',
+				default=0,
+				help='Number of pages read or written that are kept for the rest of the session, pages in the cache are not read from the device again (default: 0, disabled).'
+				)
+		parser.add_option(
+				'--blank-check',
+				dest='blank_check',
+				action='store_true',
+				default=False,
+				help='Only erase blocks that are not already blank, the blocks are given by --address or default to the M16C/62P layout. ' +
+				'Every checked page is read, which is slow at low baud rates: 64K takes about 75s at 9600 baud against about %.1fs for erasing all blocks, see --blank-check-sample and --plan.' %
+				m16c.COST_MODEL['block_erase_all']
+				)
+		parser.add_option(
+				'--blank-check-sample',
+				dest='blank_check_sample',
+				type='int',
+				default=1,
+				help='Blank check every n:th page of a block, the last page is always checked (default: 1).'
+				)
+		parser.add_option(
+				'--read-batch',
+				dest='read_batch',
+				type='int',
+				default=1,
+				help='Number of page reads sent back to back when reading or verifying, falls back to one at a time if the device does not keep up. ' +
+				'Whether the boot loader takes commands while it is sending has not been measured (default: 1).'
+				)
+		parser.add_option(
+				'--verify',
+				dest='verify',
+				action='store_true',
+				default=False,
+				help='Read back and compare everything that was written.'
+				)
+		parser.add_option(
+				'--baseline',
+				dest='baseline',
+				type='string',
+				help='The image the device already holds, --flash-delta only erases and writes the blocks that differ from it.'
+				)
+		parser.add_option(
+				'--spot-check',
+				dest='spot_check',
+				type='int',
+				default=0,
+				help='Confirm that the device holds the --baseline image by reading n random pages of it, and n of the blank pages to be written without an erase (default: 0).'
+				)
+		parser.add_option(
+				'--stub',
+				dest='stub',
+				type='string',
+				help=SUPPRESS_HELP
+				#help='Write the flash through this program run from RAM instead of the boot loader.'
+				)
+		parser.add_option(
+				'--stub-protocol',
+				dest='stub_protocol',
+				type='choice',
+				choices=m16c.STUB_PROTOCOLS.keys(),
+				default='block',
+				help=SUPPRESS_HELP
+				#help='The protocol spoken by the --stub program (default: block).'
+				)
+		parser.add_option(
+				'--trace',
+				dest='trace',
+				type='string',
+				help='Record all serial communication to a trace file.'
+				)
+		parser.add_option(
+				'--replay',
+				dest='replay',
+				type='string',
+				help='Replay a trace file instead of using a serial device and report the timing per command.'
+				)
+		parser.add_option(
+				'--replay-realtime',
+				dest='replay_realtime',
+				action='store_true',
+				default=False,
+				help='Replay reads and writes with the timing of the trace.'
+				)
+		parser.add_option(
+				'--plan',
+				dest='plan',
+				action='store_true',
+				default=False,
+				help='Do not use the device, print the commands the actions would send and how long they are estimated to take.'
+				)
+		parser.add_option(
+				'--plan-format',
+				dest='plan_format',
+				type='choice',
+				choices=['text', 'json'],
+				default='text',
+				help='Format of the --plan report, text or json (default: text).'
+				)
+		parser.add_option(
+				'--cost-model',
+				dest='cost_model',
+				type='string',
+				help='JSON file with the overhead of each command for --plan, see sm16cf-trace --calibrate.'
+				)
+		parser.add_option(
+				'--profile',
+				dest='profile',
+				type='string',
+				help='Profile the host CPU time of the run, split in phases (connect, parse, erase, write, verify etc.), and write it to this file.'
+				)
+		parser.add_option(
+				'--profile-format',
+				dest='profile_format',
+				type='choice',
+				choices=m16c.PROFILE_FORMATS,
+				default='pstats',
+				help='Format of the --profile output: pstats (one file per phase, <file>.<phase>, and all of them in <file>) or collapsed stacks (default: pstats).'
+				)
 		parser.add_option(
 				'-u', '--unsafe',
 				dest='safe',
@@ -173,6 +397,22 @@ There is NO WARRANTY, to the extent permitted by law.""")
 			 #'Erase all blocks (that are unlocked).',
 			 self.__flash_erase_all
 			),
+			(
+			 '--flash-delta',
+			 'Program the flash with the given file, only erasing and writing the blocks that differ from the --baseline image.',
+			 self.__flash_delta
+			),
+			(
+			 '--ram-program',
+			 SUPPRESS_HELP,
+			 #'Download the input file to RAM and run it.',
+			 self.__ram_program
+			),
+			(
+			 '--latency-measure',
+			 'Measure the round trip time of the serial line, with and without low latency mode.',
+			 self.__latency_measure
+			),
 			(
 			 '--id-validate',
 			 SUPPRESS_HELP,
@@ -207,8 +447,16 @@ There is NO WARRANTY, to the extent permitted by law.""")
 					' \'%s\'' * len(args) % (tuple(args))
 					)
 
+		# Profile everything from here on.
+		self.__profile = options.profile
+		self.__profiler = None
+		if self.__profile != None:
+			self.__profiler = m16c.Profiler(options.profile_format)
+			self.__profiler.start('connect')
+
 		# Check the device.
-		if options.device == None:
+		if options.device == None and options.replay == None and not options.plan and \
+				options.publish == None:
 			raise Exception('No device specified.')
 
 		# Grab device id
@@ -230,8 +478,44 @@ There is NO WARRANTY, to the extent permitted by law.""")
 			raise Exception('Device id contains invalid field(s).')
 			
 		# Grab any input/output files.
-		self.__input_file = options.input_file
+		self.__format = options.format
+		self.__base_address = options.base_address
+		self.__input_file = None
+		if options.input_file != None:
+			self.__input_file = [
+					(i, self.__format, self.__base_address)
+					for i in options.input_file
+					]
+		if options.manifest != None:
+			if self.__input_file == None:
+				self.__input_file = list()
+			self.__input_file.extend(srec.manifest_load(options.manifest))
+		self.__image = None
 		self.__output_file = options.output_file
+		self.__output_format = options.output_format
+		self.__srec_index = options.srec_index
+		self.__jobs = options.jobs
+
+		# Grab the read batch size.
+		self.__read_batch = options.read_batch
+		if self.__read_batch < 1:
+			raise Exception('Invalid read batch size.')
+
+		# Grab the delta settings.
+		self.__baseline = options.baseline
+		self.__spot_check = options.spot_check
+		if self.__spot_check < 0:
+			raise Exception('Invalid spot check count.')
+
+		# Grab the RAM program used for writing, if any.
+		self.__stub_file = options.stub
+		self.__stub_protocol = m16c.STUB_PROTOCOLS[options.stub_protocol]
+		self.__stub = None
+
+		# Grab the verify setting.
+		self.__verify = options.verify
+		if self.__verify and self.__stub_file != None:
+			raise Exception('Verify is not possible when writing through a RAM program.')
 
 		# Grab any addresses
 		self.__address = options.address
@@ -263,28 +547,105 @@ There is NO WARRANTY, to the extent permitted by law.""")
 
 			self.__address = tmp
 
+		# Grab the blank check settings.
+		self.__blank_check = options.blank_check
+		self.__blank_check_sample = options.blank_check_sample
+		if self.__blank_check_sample < 1:
+			raise Exception('Invalid blank check sample.')
+
+		# The --address range(s) can not be both the blocks to check and
+		# the indexed ranges to write.
+		if self.__blank_check and self.__srec_index:
+			raise Exception('Blank check is not possible with an indexed input file.')
+
 		# Propagate any unsafe behaviour.
 		self.__safe = options.safe
 
-		# Create a serial device
-		self.__device = serial.Serial(
-				port=options.device,
-				timeout=options.timeout
-				)
+		# Publishing needs nothing else.
+		self.__publish = options.publish
+		if self.__publish != None:
+			if self.__input_file == None:
+				raise Exception('No input file was given.')
+			self.__trace = None
+			return
+
+		# Create a serial device, one replaying a trace or one simulating
+		# the device when planning.
+		self.__replay = None
+		self.__plan = None
+		if options.plan:
+			if self.__stub_file != None:
+				raise Exception('Writing through a RAM program can not be planned.')
+
+			# The device is assumed to hold the baseline, if there is one.
+			segments = ()
+			if self.__baseline != None:
+				segments = srec.image_open(
+					self.__baseline, 'auto', self.__base_address, self.__jobs
+					).segments()
+			self.__device = m16c.PlanDevice(segments)
+
+			self.__plan = (options.plan_format, m16c.COST_MODEL)
+			if options.cost_model != None:
+				file = open(options.cost_model, 'r')
+				try:
+					self.__plan = (options.plan_format, json.load(file))
+				finally:
+					file.close()
+		elif options.replay != None:
+			file = open(options.replay, 'rb')
+			try:
+				self.__replay = m16c.trace_load(file)
+			finally:
+				file.close()
+			self.__device = m16c.ReplayDevice(
+					self.__replay,
+					options.replay_realtime
+					)
+		else:
+			self.__device = serial.Serial(
+					port=options.device,
+					timeout=options.timeout
+					)
 
 		# Make sure we managed to open the device succesfully
 		if not self.__device.isOpen():
 			raise Exception('Unable to open the serial device.')
 
+		# Tune the port itself, before anything is wrapped around it.
+		self.__serial = self.__device
+		self.__low_latency = options.low_latency
+		if self.__low_latency and self.__plan == None and self.__replay == None:
+			m16c.low_latency_set(self.__serial)
+		if options.inter_byte_timeout != None:
+			m16c.inter_byte_timeout_set(self.__serial, options.inter_byte_timeout)
+
+		# Trace the communication, a replay is always traced so that it
+		# can be compared with the original and a plan is made from the
+		# trace.
+		self.__trace = None
+		if options.trace != None or self.__replay != None or self.__plan != None:
+			file = None
+			if options.trace != None:
+				file = open(options.trace, 'wb')
+			self.__trace = m16c.TraceDevice(self.__device, file)
+			self.__device = self.__trace
+
 		# Create the flasher
 		self.__flasher = m16c.Flasher(
 				self.__device,
 				not options.clock_validation
 				)
+		self.__flasher.retry_set(options.retries, options.retry_delay)
+		self.__flasher.cache_set(options.page_cache)
+		if options.timeout_margin != None:
+			self.__flasher.timeout_set(options.timeout_margin, options.timeout)
 		if not self.__flasher.clock_validated():
 			try:
-				self.__flasher.clock_validate()
-				self.__flasher.baud_set(options.baud)
+				if not (options.fast_connect and
+						self.__flasher.clock_probe(options.baud)):
+					self.__flasher.clock_validate(options.sync_interval)
+					self.__flasher.baud_set(options.baud)
 			except m16c.FlasherException, (error):
 				if self.__safe:
 					raise
@@ -334,6 +695,16 @@ There is NO WARRANTY, to the extent permitted by law.""")
 		if not self.__flasher.id_validated():
 			self.__flasher.id_validate(self.__device_id)
 
+		# Only the indexed range(s) are written, so only the blocks they
+		# are in may be erased.
+		if self.__srec_index:
+			self.__flash_erase_index()
+			self.__flash_write()
+			return
+
+		# Parse the file(s) before anything is erased.
+		self.__image_load()
+
 		# Erase the entire flash.
 		self.__flash_erase_all()
 
@@ -356,6 +727,32 @@ There is NO WARRANTY, to the extent permitted by law.""")
 
 		print('Firmware version: %s' % self.__flasher.version_read())
 
+	def __latency_measure(self):
+		"""For internal use ONLY!"""
+
+		# Neither a plan nor a replay has a line to measure.
+		if self.__plan != None or self.__replay != None:
+			raise Exception('Latency can only be measured on a serial device, not with --plan or --replay.')
+
+		# A page write takes two round trips (ready poll and status),
+		# a page read the same plus the page itself.
+		results = list()
+		previous = m16c.low_latency_set(self.__serial, False)
+		try:
+			for enable in (False, True):
+				m16c.low_latency_set(self.__serial, enable)
+				results.append(m16c.latency_measure(self.__flasher))
+		finally:
+			m16c.low_latency_set(self.__serial, previous or self.__low_latency)
+
+		for (name, (mean, low, high)) in zip(('Normal', 'Low latency'), results):
+			transfer = 259 * 10.0 / self.__device.getBaudrate()
+			sys.stdout.write(
+					'%-12s round trip %.2fms (%.2f-%.2fms), %.1f page writes/s.\n' %
+					(name, mean * 1000, low * 1000, high * 1000,
+					1.0 / (transfer + 2 * mean))
+					)
+
 	def __id_validate(self):
 		"""For internal use ONLY!"""
 
@@ -377,28 +774,41 @@ There is NO WARRANTY, to the extent permitted by law.""")
 			if i[1] == 0:
 				raise Exception('Range 0 not allowed when reading flash.')
 
-		# And start dumping the data.
-		data = str()
+		# Output to file or stdout
+		if self.__output_file != None:
+			output = open(self.__output_file, 'wb')
+		else:
+			output = sys.stdout
+
+		if self.__output_format == 'dump':
+			writer = srec.DumpWriter(output)
+		elif self.__output_format == 'srec':
+			writer = srec.SRecWriter(output)
+		else:
+			writer = None
+
+		# And start dumping the data, the pages of a range are read back
+		# to back.
 		for i in self.__address:
 			(addr, rng)= (i[0], i[1])
-			while rng > 0:
-				tmp = self.__flasher.page_read(addr)
-				lower = addr%len(tmp)
+			pages = range(addr & 0xffff00, addr + rng, 0x100)
+			for (page, tmp) in self.__flasher.pages_read(pages, self.__read_batch):
+				lower = addr - page
 				upper = min(lower+rng, len(tmp))
-				data += tmp[lower:upper]
+				if writer != None:
+					writer.write(addr, tmp[lower:upper])
+				else:
+					output.write(tmp[lower:upper])
 				addr += upper-lower
 				rng  -= upper-lower
 
-				sys.stderr.write('\rReading 0x%06x...' % (addr & 0xffff00))
+				sys.stderr.write('\rReading 0x%06x...' % page)
 		sys.stderr.write(' Done.\n')
 
-		# Dump to file or stdout
-		if self.__output_file != None:
-			file = open(self.__output_file, 'wb')
-			file.write(data)
-			file.close()
-		else:
-			sys.stdout.write(data)
+		if writer != None:
+			writer.close()
+		if output != sys.stdout:
+			output.close()
 
 
 	def __flash_write(self):
@@ -407,18 +817,46 @@ There is NO WARRANTY, to the extent permitted by law.""")
 		if self.__input_file == None:
 			raise Exception('No input file was given.')
 
-		# Parse the file.
-		file = open(self.__input_file)
-		file = srec.SRecFile(file)
+		# Only the given range(s), loaded through the index.
+		if self.__srec_index:
+			if self.__address == None:
+				raise Exception('No address specified.')
+
+			if len(self.__input_file) != 1:
+				raise Exception('Only a single input file may be indexed.')
 
-		# Write the segments of the file.
+			index = srec.SRecIndex(self.__input_file[0][0])
+			for i in self.__address:
+				for j in index.segments(i[0], i[1]):
+					self.__flasher.segment_write(j)
+					if self.__verify:
+						self.__flasher.segment_verify(j, self.__read_batch)
+			return
+
+		# Parse the file(s).
+		file = self.__image_load()
+
+		# Write the segments of the file, through the RAM program if
+		# there is one.
+		self.phase('write')
+		writer = self.__flasher
+		if self.__stub_file != None:
+			writer = self.__stub_get()
 		for i in file.segments():
-			self.__flasher.segment_write(i)
+			writer.segment_write(i)
+
+		# Read everything back once it has all been written.
+		if self.__verify:
+			self.phase('verify')
+			for i in file.segments():
+				self.__flasher.segment_verify(i, self.__read_batch)
 
 	
 	def __flash_erase(self):
 		"""For internal use ONLY!"""
 
+		self.phase('erase')
+
 		if self.__address == None:
 			raise Exception('No address specified.')
 		
@@ -427,14 +865,147 @@ There is NO WARRANTY, to the extent permitted by law.""")
 			if i[0] > 0xffff00:
 				raise Exception('Address out of range (beyond theorethical).')
 
-			# Erase the block.
-			self.__flasher.block_erase(i[0])
+			# Erase the block, unless it is known to be blank.
+			if self.__blank_check and i[1] != 0:
+				if not self.__flasher.block_erase_check(
+						i[0], i[1], self.__blank_check_sample
+						):
+					sys.stderr.write('Block 0x%06x is blank, skipped.\n' % i[0])
+			else:
+				self.__flasher.block_erase(i[0])
 
 	def __flash_erase_all(self):
 		"""For internal use ONLY!"""
-		
-		# Erase all unlocked blocks.
-		self.__flasher.block_erase_all()
+
+		self.phase('erase')
+
+		if not self.__blank_check:
+			# Erase all unlocked blocks.
+			self.__flasher.block_erase_all()
+			return
+
+		# Erase only the blocks that are not blank.
+		if self.__address != None:
+			self.__flasher.blocks_set(self.__address)
+		blocks = self.__flasher.blocks()
+
+		# Blocks outside the layout are never checked nor erased, so
+		# whatever is written must be within it.
+		if self.__input_file != None:
+			for (addr, data) in self.__image_load().segments():
+				for page in range(addr & 0xffff00, addr + len(data), 0x100):
+					if len([i for i in blocks if i[0] <= page < i[0] + i[1]]) == 0:
+						sys.stderr.write(
+								'Warning: Input file at 0x%06x is outside the blank checked blocks, erasing all blocks.\n' % page
+								)
+						self.__flasher.block_erase_all()
+						return
+
+		erased = self.__flasher.blocks_erase(self.__blank_check_sample)
+		sys.stderr.write(
+				'Erased %d block(s), %d blank block(s) skipped.\n' %
+				(erased, len(self.__flasher.blocks()) - erased)
+				)
+
+	def __flash_erase_index(self):
+		"""For internal use ONLY!"""
+
+		self.phase('erase')
+
+		if self.__address == None:
+			raise Exception('No address specified.')
+
+		# Find every block of the layout the range(s) touch, before
+		# erasing any of them.
+		blocks = self.__flasher.blocks()
+		erase = list()
+		for (addr, size) in self.__address:
+			for page in range(addr & 0xffff00, addr + size, 0x100):
+				block = [i for i in blocks if i[0] <= page < i[0] + i[1]]
+				if len(block) == 0:
+					raise Exception(
+							'Address 0x%06x is not within any flash block.' % page
+							)
+				if not block[0] in erase:
+					erase.append(block[0])
+
+		for (addr, size) in erase:
+			# Any address in the block will do, use the highest page.
+			self.__flasher.block_erase((addr + size - 1) & 0xffff00)
+
+	def __flash_delta(self):
+		"""For internal use ONLY!"""
+
+		if self.__input_file == None:
+			raise Exception('No input file was given.')
+		if self.__baseline == None:
+			raise Exception('No baseline was given.')
+
+		# Validate.
+		if not self.__flasher.id_validated():
+			self.__flasher.id_validate(self.__device_id)
+
+		# Both images are compared on the host, the device is only used
+		# for the (optional) spot check.
+		self.phase('parse')
+		baseline = srec.image_open(
+				self.__baseline, 'auto', self.__base_address, self.__jobs
+				)
+		image = self.__image_load()
+
+		blocks = self.__flasher.blocks()
+		if self.__address != None:
+			blocks = self.__address
+
+		self.phase('plan')
+		plan = m16c.DeltaPlan(baseline.segments(), image.segments(), blocks)
+		self.phase('write')
+		plan.run(self.__flasher, self.__spot_check)
+		if self.__verify:
+			self.phase('verify')
+			for i in image.segments():
+				self.__flasher.segment_verify(i, self.__read_batch)
+		sys.stderr.write(
+				'Erased %d of %d block(s), wrote %d page(s).\n' %
+				(len(plan.erase()), len(blocks), len(plan.write()))
+				)
+
+	def __image_load(self):
+		"""For internal use ONLY!"""
+
+		if self.__image != None:
+			return self.__image
+
+		# Several files are combined into one image, checking that they
+		# do not overlap, so that they are written in one pass.
+		previous = self.phase('parse')
+		if len(self.__input_file) == 1:
+			(path, format, base) = self.__input_file[0]
+			self.__image = srec.image_open(path, format, base, self.__jobs)
+		else:
+			self.__image = srec.ImageSet(self.__input_file, self.__jobs)
+		self.phase(previous)
+		return self.__image
+
+	def __ram_image(self, path):
+		"""For internal use ONLY!"""
+
+		segments = srec.image_open(path).segments()
+		if len(segments) != 1:
+			raise Exception('RAM program must be a single segment.')
+		return segments[0][1]
+
+	def __stub_get(self):
+		"""For internal use ONLY!"""
+
+		# Download and start the RAM program the first time it is used,
+		# after that the boot loader is gone.
+		if self.__stub == None:
+			self.__stub = self.__flasher.stub_load(
+					self.__ram_image(self.__stub_file),
+					self.__stub_protocol
+					)
+		return self.__stub
 
 	def __ram_program(self):
 		"""For internal use ONLY!"""
@@ -442,6 +1013,11 @@ There is NO WARRANTY, to the extent permitted by law.""")
 		if self.__input_file == None:
 			raise Exception('No input file was given.')
 
+		if len(self.__input_file) != 1:
+			raise Exception('The RAM program must be a single input file.')
+
+		self.__flasher.program_run(self.__ram_image(self.__input_file[0][0]))
+
 	def __device_reset(self):
 		"""For internal use ONLY!"""
 
@@ -463,9 +1039,56 @@ There is NO WARRANTY, to the extent permitted by law.""")
 		time.sleep(self.__reset_time)
 		reset(True)
 
+	def phase(self, name):
+		"""Charge the host CPU time from now on to phase name, when
+		profiling. Returns the previous phase."""
+
+		if self.__profiler == None:
+			return None
+		return self.__profiler.phase(name)
+
 	def run(self):
 
-		for i in self.__action:
-			i()
+		try:
+			if self.__publish != None:
+				srec.image_publish(self.__image_load().segments(), self.__publish)
+				return
+
+			for i in self.__action:
+				self.phase(i.__name__.strip('_').replace('_', '-'))
+				i()
+		finally:
+			if self.__trace != None:
+				self.__trace.close()
+			if self.__profiler != None:
+				self.__profiler.stop()
+				self.__profiler.write(self.__profile)
+
+		# Nothing was sent to a device, report what would have been.
+		if self.__plan != None:
+			(format, model) = self.__plan
+			sys.stdout.write(m16c.plan_report(
+					m16c.plan_commands(self.__trace.events()),
+					model,
+					format
+					))
+			return
+
+		# Compare the replay with the trace.
+		if self.__replay != None:
+			sys.stderr.write(m16c.trace_report(
+					self.__replay,
+					self.__trace.events()
+					))
+			if not self.__device.done():
+				sys.stderr.write('Warning: Replay stopped before the end of the trace.\n')
+
+		# Let the user know if the line is noisy.
+		retries = self.__flasher.retry_count()
+		if retries['page_read'] or retries['page_write'] or retries['page_batch']:
+			sys.stderr.write(
+					'Retries: %d page read(s), %d page write(s), %d failed read batch(es).\n' %
+					(retries['page_read'], retries['page_write'], retries['page_batch'])
+					)
 
 
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""Flash time planning without a device.
+
+A PlanDevice answers like the boot loader of a healthy M16C, so Flasher
+issues exactly the commands it would issue to a real device. Recording
+them with a TraceDevice gives the command sequence of a job, which the
+cost model turns into an estimated duration:
+
+	transfer time (10 bits per byte at the current baud rate)
+	+ overhead of the command (programming, erasing etc.)
+	+ latency of the line, for each command that is answered
+
+The overheads can be calibrated from a trace of a real device."""
+
+import struct, json
+from srec import segments_pages
+from TraceDevice import trace_commands, _command_length
+from Flasher import M16C62P_BLOCKS
+
+# Rough figures for a M16C/62P at 16MHz over a USB serial adapter, in
+# seconds. Use cost_calibrate to get figures for a real setup.
+COST_MODEL = {
+	'latency': 0.002,
+	'clock_sync': 0.02,
+	'page_write': 0.003,
+	'block_erase': 0.3,
+	'block_erase_all': 3.6,
+	}
+
+class PlanDevice:
+	"""Serial device simulating the boot loader of a M16C.
+
+	The flash starts out blank unless segments are given, and erases
+	follow the block layout."""
+
+	def __init__(self, segments=(), blocks=M16C62P_BLOCKS, baud=9600):
+		self.__blocks = blocks
+		self.__baud = baud
+		self.__timeout = None
+		self.__stream = ''
+		self.__output = ''
+		self.__zeros = 0
+		self.__id_ok = False
+		self.__pages = segments_pages(segments)
+
+	def __page(self, addr):
+		"""For internal use ONLY!"""
+
+		return self.__pages.get(addr & 0xffff00, '\xff' * 256)
+
+	def __command(self, command):
+		"""For internal use ONLY!"""
+
+		opcode = ord(command[0])
+		addr = 0
+		if len(command) >= 3:
+			addr = (ord(command[1]) << 8) | (ord(command[2]) << 16)
+
+		if opcode == 0x00:
+			# The clock is synchronised after 16 zeros.
+			self.__zeros += 1
+			if self.__zeros == 16:
+				self.__output += '\xb0'
+			return
+		self.__zeros = 0
+
+		if opcode == 0x70:
+			status = 0x80
+			if self.__id_ok:
+				status |= 0xc00
+			self.__output += struct.pack('<H', status)
+		elif opcode in (0xb0, 0xb1, 0xb2, 0xb3):
+			self.__output += command
+		elif opcode == 0xfb:
+			self.__output += 'VER.PLAN'
+		elif opcode == 0xf5:
+			self.__id_ok = True
+		elif opcode in (0xff, 0xfc):
+			self.__output += self.__page(addr)
+		elif opcode == 0x41:
+			# Programming can only clear bits.
+			self.__pages[addr] = str(bytearray([
+					a & b for (a, b) in
+					zip(bytearray(self.__page(addr)), bytearray(command[3:]))
+					]))
+		elif opcode == 0x20:
+			for (lower, size) in self.__blocks:
+				if lower <= addr < lower + size:
+					for page in range(lower, lower + size, 0x100):
+						self.__pages.pop(page, None)
+		elif opcode == 0xa7:
+			self.__pages.clear()
+
+	def write(self, data):
+		self.__stream += data
+		while len(self.__stream) > 0:
+			length = _command_length(self.__stream)
+			if length == None or length > len(self.__stream):
+				break
+			self.__command(self.__stream[:length])
+			self.__stream = self.__stream[length:]
+
+	def read(self, size=1):
+		data = self.__output[:size]
+		self.__output = self.__output[size:]
+		return data
+
+	def getBaudrate(self):
+		return self.__baud
+
+	def setBaudrate(self, baud):
+		self.__baud = baud
+
+	def getTimeout(self):
+		return self.__timeout
+
+	def setTimeout(self, timeout):
+		self.__timeout = timeout
+
+	def flushInput(self):
+		self.__output = ''
+
+	def setRTS(self, level):
+		pass
+
+	def setDTR(self, level):
+		pass
+
+	def isOpen(self):
+		return True
+
+def plan_commands(events, baud=9600):
+	"""Split the events of a trace into commands with the baud rate they
+	were sent at, (name, baud, bytes written, bytes read)."""
+
+	commands = list()
+	start = 0
+	for i in range(len(events) + 1):
+		if i == len(events) or events[i][0] == 'B':
+			for command in trace_commands(events[start:i]):
+				commands.append((command[0], baud, command[3], command[4]))
+			if i < len(events):
+				baud = events[i][3]
+			start = i + 1
+	return commands
+
+def plan_cost(commands, model=COST_MODEL):
+	"""Estimated duration of each command, in seconds."""
+
+	latency = model.get('latency', 0.0)
+	costs = list()
+	for (name, baud, written, read) in commands:
+		cost = (written + read) * 10.0 / baud + model.get(name, 0.0)
+		if read > 0:
+			cost += latency
+		costs.append(cost)
+	return costs
+
+def cost_calibrate(events, baud=9600):
+	"""Cost model with the overheads measured in a trace of a device.
+
+	The latency of the line can not be told apart from the overheads so
+	it ends up in them."""
+
+	commands = trace_commands(events)
+	model = {'latency': 0.0}
+	totals = dict()
+	for ((name, start, duration, written, read), planned) in zip(
+			commands, plan_commands(events, baud)
+			):
+		overhead = duration - (written + read) * 10.0 / planned[1]
+		(count, total) = totals.get(name, (0, 0.0))
+		totals[name] = (count + 1, total + max(0.0, overhead))
+
+	for (name, (count, total)) in totals.items():
+		model[name] = total / count
+	return model
+
+def plan_report(commands, model=COST_MODEL, format='text'):
+	"""Report of the estimated duration per command, as text or json.
+
+	The JSON report also holds the whole command sequence."""
+
+	costs = plan_cost(commands, model)
+	summary = dict()
+	for ((name, baud, written, read), cost) in zip(commands, costs):
+		(count, size, total) = summary.get(name, (0, 0, 0.0))
+		summary[name] = (count + 1, size + written + read, total + cost)
+
+	if format == 'json':
+		return json.dumps({
+				'duration': sum(costs),
+				'commands': dict([
+						(name, {'count': count, 'bytes': size, 'seconds': total})
+						for (name, (count, size, total)) in summary.items()
+						]),
+				'sequence': [
+						[name, baud, written, read]
+						for (name, baud, written, read) in commands
+						],
+				}, indent=1, sort_keys=True, separators=(',', ': ')) + '\n'
+
+	lines = ['%-16s %8s %10s %12s' % ('Command', 'Count', 'Bytes', 'Seconds')]
+	for name in sorted(summary.keys()):
+		(count, size, total) = summary[name]
+		lines.append('%-16s %8d %10d %12.3f' % (name, count, size, total))
+	lines.append('%-16s %8d %10d %12.3f' % (
+			'Total',
+			len(commands),
+			sum([i[2] + i[3] for i in commands]),
+			sum(costs)
+			))
+	return '\n'.join(lines) + '\n'
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""Host CPU profiling of a run, split in phases.
+
+The phase (parse, erase, write, verify etc.) is switched by whoever
+drives the run, everything profiled is charged to the current phase.
+Two output formats:
+
+	pstats      cProfile statistics, one file per phase (<file>.<phase>)
+	            and all phases together in <file>
+	collapsed   one line per call stack, 'phase;frame;frame... usec',
+	            as read by flamegraph.pl and speedscope
+
+Collapsed stacks are recorded by a profile function rather than by
+sampling, a timer signal would interrupt the serial reads."""
+
+import os, sys, time, cProfile, pstats
+
+PROFILE_FORMATS = ['pstats', 'collapsed']
+
+class ProfilerException(Exception):
+	"""Base class for profiler exceptions."""
+
+class Profiler:
+	"""Class profiling the host CPU time of a run."""
+
+	def __init__(self, format='pstats'):
+		if not format in PROFILE_FORMATS:
+			raise ProfilerException('Invalid profile format \'%s\'.' % format)
+
+		self.__format = format
+		self.__phase = None
+		self.__running = False
+
+		# pstats, a profile per phase.
+		self.__profiles = dict()
+
+		# collapsed, CPU seconds per (phase, frame, ...).
+		self.__stacks = dict()
+		self.__stack = list()
+		self.__clock = None
+
+	def __profile(self):
+		"""For internal use ONLY!"""
+
+		if not self.__phase in self.__profiles:
+			self.__profiles[self.__phase] = cProfile.Profile()
+		return self.__profiles[self.__phase]
+
+	def __charge(self):
+		"""For internal use ONLY!"""
+
+		now = time.clock()
+		key = tuple([self.__phase] + self.__stack)
+		self.__stacks[key] = self.__stacks.get(key, 0.0) + now - self.__clock
+		self.__clock = now
+
+	def __trace(self, frame, event, arg):
+		"""For internal use ONLY!"""
+
+		self.__charge()
+		if event == 'call':
+			code = frame.f_code
+			self.__stack.append('%s:%s' % (os.path.basename(code.co_filename), code.co_name))
+		elif event == 'c_call':
+			self.__stack.append(getattr(arg, '__name__', '?'))
+		elif len(self.__stack) != 0:
+			# Returns from frames active when we started have nothing
+			# to pop.
+			self.__stack.pop()
+
+	def start(self, phase='run'):
+		"""Start profiling, charging everything to phase."""
+
+		if self.__running:
+			raise ProfilerException('Profiler already running.')
+
+		self.__phase = phase
+		self.__running = True
+		if self.__format == 'pstats':
+			self.__profile().enable()
+		else:
+			self.__clock = time.clock()
+			sys.setprofile(self.__trace)
+
+	def phase(self, name):
+		"""Charge everything from now on to phase name.
+
+		Returns the previous phase so that it can be restored."""
+
+		previous = self.__phase
+		if not self.__running or name == previous:
+			self.__phase = name
+			return previous
+
+		if self.__format == 'pstats':
+			self.__profile().disable()
+			self.__phase = name
+			self.__profile().enable()
+		else:
+			self.__charge()
+			self.__phase = name
+		return previous
+
+	def stop(self):
+		"""Stop profiling."""
+
+		if not self.__running:
+			return
+
+		if self.__format == 'pstats':
+			self.__profile().disable()
+		else:
+			sys.setprofile(None)
+			self.__charge()
+		self.__running = False
+
+	def write(self, path):
+		"""Write the profile, see the module for the files written."""
+
+		if self.__format == 'pstats':
+			combined = None
+			for (phase, profile) in self.__profiles.items():
+				profile.dump_stats('%s.%s' % (path, phase))
+				if combined == None:
+					combined = pstats.Stats(profile)
+				else:
+					combined.add(profile)
+			if combined != None:
+				combined.dump_stats(path)
+			return
+
+		file = open(path, 'w')
+		try:
+			for stack in sorted(self.__stacks.keys()):
+				usec = int(self.__stacks[stack] * 1e6)
+				if usec > 0:
+					file.write('%s %d\n' % (';'.join(stack), usec))
+		finally:
+			file.close()
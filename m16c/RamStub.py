@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Protocols for flashing through a program run from RAM.
+
+The boot loader writes one 256 byte page per round trip. A program
+downloaded to RAM (Flasher.stub_load) can take over the serial line and
+speak a protocol of its own, e.g. with larger blocks and compressed
+data. The protocol classes here are the host side of such programs."""
+
+import struct, zlib
+from Flasher import FlasherException
+
+# Seconds for the program to answer once started, and to program a
+# block once received, on top of the time spent on the line.
+STUB_CONNECT_TIMEOUT = 1.0
+STUB_BLOCK_TIMEOUT = 1.0
+
+class StubProtocol:
+	"""Base class for protocols spoken by a program run from RAM."""
+
+	def __init__(self, device):
+		self._device = device
+
+	def _read(self, size, timeout, sent=0):
+		"""Read size bytes, waiting timeout seconds on top of the time it
+		takes to send the sent bytes and receive the reply. The timeout
+		of the device is left as it was, the Flasher sets it per read."""
+
+		saved_timeout = self._device.getTimeout()
+		self._device.setTimeout(
+				(sent + size) * 10.0 / self._device.getBaudrate() + timeout
+				)
+		try:
+			return self._device.read(size)
+		finally:
+			self._device.setTimeout(saved_timeout)
+
+	def connect(self):
+		"""Make sure the program runs, raise FlasherException if not."""
+
+		raise FlasherException('Protocol does not support connecting.')
+
+	def segment_write(self, segment):
+		"""Write a segment (address+data) to the device."""
+
+		raise FlasherException('Protocol does not support writing.')
+
+class BlockStub(StubProtocol):
+	"""Block transfers with host side compression.
+
+	connect  host 0x55, program 'SM16' and the block size / 256 (1)
+	write    host 'W', address (3), size (2), compressed size (2) and the
+	         zlib compressed data, or 0 and the data as is if it does
+	         not compress. The program replies with a status byte, 0 on
+	         success. Blocks never cross a block size boundary.
+
+	All integers are little endian."""
+
+	def __init__(self, device):
+		StubProtocol.__init__(self, device)
+		self.__block_size = None
+
+	def connect(self):
+
+		self._device.write('\x55')
+		reply = self._read(5, STUB_CONNECT_TIMEOUT, 1)
+		if len(reply) != 5 or reply[:4] != 'SM16' or reply[4] == '\x00':
+			raise FlasherException('No answer from the RAM program.')
+		self.__block_size = ord(reply[4]) * 256
+
+	def __block_write(self, addr, data):
+		"""For internal use ONLY!"""
+
+		compressed = zlib.compress(data, 9)
+		if len(compressed) >= len(data):
+			(compressed, size) = (data, 0)
+		else:
+			size = len(compressed)
+
+		block = struct.pack(
+				'<cHBHH',
+				'W',
+				addr & 0xffff,
+				(addr >> 16) & 0xff,
+				len(data),
+				size
+				) + compressed
+		self._device.write(block)
+
+		status = self._read(1, STUB_BLOCK_TIMEOUT, len(block))
+		if len(status) != 1:
+			raise FlasherException('Timeout writing block 0x%06x.' % addr)
+		if status != '\x00':
+			raise FlasherException(
+					'Writing block 0x%06x failed (0x%02x).' % (addr, ord(status))
+					)
+
+	def segment_write(self, segment):
+
+		if self.__block_size == None:
+			raise FlasherException('Not connected to the RAM program.')
+
+		(addr, data) = segment
+		if addr < 0 or (addr + len(data)) > 0xffffff:
+			raise FlasherException('Invalid segment address.')
+
+		sent = 0
+		while sent < len(data):
+			size = self.__block_size - ((addr + sent) % self.__block_size)
+			self.__block_write(addr + sent, data[sent:sent+size])
+			sent += size
+
+# Protocols by name, for the command line.
+STUB_PROTOCOLS = {
+	'block': BlockStub,
+	}
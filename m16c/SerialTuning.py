@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""Serial port tuning for short request/reply exchanges.
+
+Most boot loader commands are answered with a 2 byte status or a 256
+byte page, so the time a command takes over a USB serial adapter is
+set by the latency timer of the driver (16ms by default for FTDI) rather
+than by the baud rate. On Linux the low latency flag of the port makes
+the driver hand over received data right away."""
+
+import sys, time, array
+
+TIOCGSERIAL = 0x541e
+TIOCSSERIAL = 0x541f
+ASYNC_LOW_LATENCY = 1 << 13
+
+class SerialTuningException(Exception):
+	"""Base class for serial tuning exceptions."""
+
+def low_latency_set(device, enable=True):
+	"""Set or clear the low latency flag of the port (Linux only).
+
+	Returns the previous setting."""
+
+	if not sys.platform.startswith('linux'):
+		raise SerialTuningException('Low latency mode is only supported on Linux.')
+
+	import fcntl
+
+	try:
+		fd = device.fileno()
+	except AttributeError:
+		raise SerialTuningException('Low latency mode needs a serial port.')
+
+	# struct serial_struct, flags is the fifth int.
+	buf = array.array('i', [0] * 32)
+	try:
+		fcntl.ioctl(fd, TIOCGSERIAL, buf)
+		previous = (buf[4] & ASYNC_LOW_LATENCY) != 0
+		if enable:
+			buf[4] |= ASYNC_LOW_LATENCY
+		else:
+			buf[4] &= ~ASYNC_LOW_LATENCY
+		fcntl.ioctl(fd, TIOCSSERIAL, buf)
+	except IOError, (error):
+		raise SerialTuningException('Unable to set low latency mode: %s' % error)
+
+	return previous
+
+def inter_byte_timeout_set(device, timeout):
+	"""Give up on a reply once no byte has arrived for timeout seconds,
+	rather than waiting for the whole read timeout."""
+
+	# pyserial 3.x, and the 2.x name for it.
+	if hasattr(device, 'inter_byte_timeout'):
+		device.inter_byte_timeout = timeout
+	elif hasattr(device, 'setInterCharTimeout'):
+		device.setInterCharTimeout(timeout)
+	else:
+		raise SerialTuningException('The serial device has no inter byte timeout.')
+
+def latency_measure(flasher, count=50):
+	"""Time count status reads, the shortest round trip there is.
+
+	Returns (mean, min, max) in seconds."""
+
+	times = list()
+	for i in range(count):
+		start = time.time()
+		flasher.status_read()
+		times.append(time.time() - start)
+
+	return (sum(times) / count, min(times), max(times))
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Serial protocol tracing and replay.
+
+A trace is a binary file starting with a header, magic (8), version (1)
+and the time the trace was started (8), followed by one record per
+device call: kind (1, 'W'rite, 'R'ead or 'B'aud rate), time since the
+start (8), duration (8), requested size or baud rate (4) and the length
+of the data (4), followed by the data itself. All integers and doubles
+are little endian."""
+
+import time, struct
+
+TRACE_MAGIC = 'SM16TRCE'
+TRACE_VERSION = 1
+
+# Boot loader commands, opcode: (name, length of the command). The length
+# of some commands depends on their content, see _command_length.
+COMMANDS = {
+	0x00: ('clock_sync', 1),
+	0x20: ('block_erase', 4),
+	0x41: ('page_write', 259),
+	0x50: ('status_clear', 1),
+	0x70: ('status_read', 1),
+	0x75: ('lock_disable', 1),
+	0x7a: ('lock_enable', 1),
+	0xa7: ('block_erase_all', 2),
+	0xb0: ('baud_set', 1),
+	0xb1: ('baud_set', 1),
+	0xb2: ('baud_set', 1),
+	0xb3: ('baud_set', 1),
+	0xf5: ('id_validate', None),
+	0xfa: ('program_run', None),
+	0xfb: ('version_read', 1),
+	0xfc: ('boot_read', 3),
+	0xff: ('page_read', 3),
+	}
+
+class TraceException(Exception):
+	"""Base class for trace exceptions."""
+
+class TraceDevice:
+	"""Serial device wrapper recording every write and read to a trace.
+
+	Anything but reads, writes and baud rate changes is passed straight
+	on to the wrapped device."""
+
+	def __init__(self, device, file=None):
+		self.__device = device
+		self.__file = file
+		self.__events = list()
+		self.__start = time.time()
+		if self.__file != None:
+			self.__file.write(struct.pack(
+					'<8sBd', TRACE_MAGIC, TRACE_VERSION, self.__start
+					))
+
+	def __getattr__(self, name):
+		return getattr(self.__device, name)
+
+	def __event(self, kind, start, requested, data):
+		"""For internal use ONLY!"""
+
+		event = (kind, start - self.__start, time.time() - start, requested, data)
+		self.__events.append(event)
+		if self.__file != None:
+			self.__file.write(struct.pack('<cddII', *(event[:4] + (len(data),))))
+			self.__file.write(data)
+
+	def write(self, data):
+		start = time.time()
+		result = self.__device.write(data)
+		self.__event('W', start, len(data), data)
+		return result
+
+	def read(self, size=1):
+		start = time.time()
+		data = self.__device.read(size)
+		self.__event('R', start, size, data)
+		return data
+
+	def setBaudrate(self, baud):
+		start = time.time()
+		self.__device.setBaudrate(baud)
+		self.__event('B', start, baud, '')
+
+	def events(self):
+		"""The events recorded so far, (kind, time, duration, size, data)."""
+
+		return self.__events
+
+	def close(self):
+		"""Close the trace file, the device is left open."""
+
+		if self.__file != None:
+			self.__file.close()
+			self.__file = None
+
+class ReplayDevice:
+	"""Serial device replaying a trace.
+
+	Writes must match the trace and reads return what was read when the
+	trace was recorded. With realtime, reads and writes also take as
+	long as they did then."""
+
+	def __init__(self, events, realtime=False, baud=9600):
+		self.__events = events
+		self.__position = 0
+		self.__realtime = realtime
+		self.__baud = baud
+
+	def __next(self, kind, requested, data=None):
+		"""For internal use ONLY!"""
+
+		if self.__position >= len(self.__events):
+			raise TraceException(
+					'Replay diverged: trace ended at event %d.' % self.__position
+					)
+
+		event = self.__events[self.__position]
+		if event[0] != kind or event[3] != requested or \
+				(data != None and event[4] != data):
+			raise TraceException(
+					'Replay diverged at event %d.' % self.__position
+					)
+		self.__position += 1
+
+		if self.__realtime:
+			time.sleep(event[2])
+
+		return event
+
+	def write(self, data):
+		self.__next('W', len(data), data)
+
+	def read(self, size=1):
+		return self.__next('R', size)[4]
+
+	def getBaudrate(self):
+		return self.__baud
+
+	def setBaudrate(self, baud):
+		self.__next('B', baud)
+		self.__baud = baud
+
+	def getTimeout(self):
+		return None
+
+	def setTimeout(self, timeout):
+		pass
+
+	def flushInput(self):
+		pass
+
+	def isOpen(self):
+		return True
+
+	def done(self):
+		"""True once the whole trace has been replayed."""
+
+		return self.__position == len(self.__events)
+
+def trace_load(file):
+	"""Load the events of a trace, (kind, time, duration, size, data)."""
+
+	data = file.read()
+	try:
+		(magic, version, start) = struct.unpack('<8sBd', data[:17])
+	except struct.error:
+		raise TraceException('Trace too short (%d).' % len(data))
+
+	if magic != TRACE_MAGIC:
+		raise TraceException('Not a trace file.')
+	if version != TRACE_VERSION:
+		raise TraceException('Unsupported trace version (%d).' % version)
+
+	events = list()
+	offset = 17
+	while offset < len(data):
+		try:
+			event = struct.unpack('<cddII', data[offset:offset+25])
+		except struct.error:
+			raise TraceException('Truncated trace at offset %d.' % offset)
+		offset += 25
+		events.append(event[:4] + (data[offset:offset+event[4]],))
+		offset += event[4]
+
+	return events
+
+def _command_length(stream):
+	"""For internal use ONLY!"""
+
+	opcode = ord(stream[0])
+	length = COMMANDS.get(opcode, (None, 1))[1]
+
+	# Id validation and program download carry their own length.
+	if opcode == 0xf5 and len(stream) >= 5:
+		length = 5 + ord(stream[4])
+	elif opcode == 0xfa and len(stream) >= 3:
+		length = 4 + (ord(stream[1]) | (ord(stream[2]) << 8))
+
+	return length
+
+def trace_commands(events):
+	"""Split the events of a trace into boot loader commands.
+
+	Returns a list of (name, time, duration, bytes written, bytes read)
+	where duration runs from the first write of the command to the end
+	of the last event before the next command."""
+
+	commands = list()
+	stream = ''
+	for (kind, start, duration, requested, data) in events:
+		if kind == 'W':
+			# A write may hold part of a command, or several of them.
+			while len(data) > 0:
+				if stream == '':
+					name = COMMANDS.get(ord(data[0]), ('unknown', 1))[0]
+					commands.append([name, start, 0.0, 0, 0])
+
+				stream += data
+				length = _command_length(stream)
+				if length == None or length > len(stream):
+					used = len(data)
+				else:
+					used = length - (len(stream) - len(data))
+					stream = ''
+
+				commands[-1][3] += used
+				data = data[used:]
+
+		elif kind == 'R' and len(commands) != 0:
+			commands[-1][4] += len(data)
+
+		if len(commands) != 0:
+			commands[-1][2] = start + duration - commands[-1][1]
+
+	return [tuple(i) for i in commands]
+
+def trace_summary(commands):
+	"""Count and total duration per command name."""
+
+	summary = dict()
+	for (name, start, duration, written, read) in commands:
+		(count, total) = summary.get(name, (0, 0.0))
+		summary[name] = (count + 1, total + duration)
+	return summary
+
+def trace_compare(old, new):
+	"""Per command timing of two traces, (name, count, mean, count, mean).
+
+	The mean durations are in seconds, None when a trace does not have
+	the command at all."""
+
+	old = trace_summary(trace_commands(old))
+	new = trace_summary(trace_commands(new))
+
+	result = list()
+	for name in sorted(set(old.keys()) | set(new.keys())):
+		row = [name]
+		for i in (old, new):
+			(count, total) = i.get(name, (0, 0.0))
+			if count == 0:
+				row.extend([0, None])
+			else:
+				row.extend([count, total / count])
+		result.append(tuple(row))
+	return result
+
+def trace_report(old, new=None):
+	"""Text report of the per command timing of one trace, or of the
+	difference between two of them. Times are in milliseconds."""
+
+	def ms(value):
+		if value == None:
+			return '-'
+		return '%.2f' % (value * 1000)
+
+	if new == None:
+		lines = ['%-16s %8s %12s %12s' % ('Command', 'Count', 'Total', 'Mean')]
+		summary = trace_summary(trace_commands(old))
+		for name in sorted(summary.keys()):
+			(count, total) = summary[name]
+			lines.append('%-16s %8d %12s %12s' % (name, count, ms(total), ms(total / count)))
+	else:
+		lines = ['%-16s %8s %12s %8s %12s %12s' % (
+				'Command', 'Count', 'Mean', 'Count', 'Mean', 'Delta'
+				)]
+		for (name, old_count, old_mean, new_count, new_mean) in trace_compare(old, new):
+			delta = None
+			if old_mean != None and new_mean != None:
+				delta = new_mean - old_mean
+			lines.append('%-16s %8d %12s %8d %12s %12s' % (
+					name, old_count, ms(old_mean), new_count, ms(new_mean), ms(delta)
+					))
+
+	return '\n'.join(lines) + '\n'
@@ -21,4 +21,11 @@
 #
 
 from Flasher import *
+from TraceDevice import *
+from RamStub import *
+from PlanDevice import *
+from SerialTuning import *
+from Profiler import *
+from DeltaPlan import *
+from JobScheduler import *
 from M16CFlashApp import *
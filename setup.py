@@ -28,6 +28,6 @@ setup(
 	description='A simple serial line flasher for M16C.',
 	author='Simon Aittamaa',
 	author_email='simon.aittamaa@ltu.se',
-	scripts=['sm16cf'],
+	scripts=['sm16cf', 'sm16cf-trace', 'sm16cf-farm'],
 	packages=['m16c', 'srec']
 	)
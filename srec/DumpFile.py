@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Sparse, compressed flash dumps.
+
+A dump only holds the pages that are not blank (0xff), each page is
+compressed on its own and has a SHA-1 of its content. The layout is:
+
+	header    magic (8), version (1), page size (2)
+	pages     zlib compressed page data
+	index     address (4), offset (4), compressed size (4), size (2),
+	          sha1 (20) for each page
+	trailer   index offset (4), number of pages (4), magic (8)
+
+All integers are little endian. The index is at the end so that a dump
+can be written to a stream, e.g. stdout, as the pages are read."""
+
+import struct, zlib, hashlib
+from Segments import segments_merge
+
+DUMP_MAGIC = 'SM16DUMP'
+DUMP_VERSION = 1
+
+class DumpException(Exception):
+	"""Base class for flash dump exceptions."""
+
+class DumpWriter:
+	"""Class for writing a sparse flash dump."""
+
+	def __init__(self, file, page_size=256):
+		self.__file = file
+		self.__page_size = page_size
+		self.__blank = '\xff' * page_size
+		self.__index = list()
+		self.__offset = 0
+		self.__pending = None
+		self.__write(struct.pack('<8sBH', DUMP_MAGIC, DUMP_VERSION, page_size))
+
+	def __write(self, data):
+		"""For internal use ONLY!"""
+
+		self.__file.write(data)
+		self.__offset += len(data)
+
+	def __page(self, addr, data):
+		"""For internal use ONLY!"""
+
+		# Blank pages are never stored, they are what the flash
+		# contains after an erase anyway.
+		if data == self.__blank[:len(data)]:
+			return
+
+		compressed = zlib.compress(data)
+		self.__index.append(struct.pack(
+				'<IIIH20s',
+				addr,
+				self.__offset,
+				len(compressed),
+				len(data),
+				hashlib.sha1(data).digest()
+				))
+		self.__write(compressed)
+
+	def write(self, addr, data):
+		"""Add data read at the address to the dump."""
+
+		# Data that continues where the last write ended is joined with
+		# it so that partial reads still end up as whole pages.
+		if self.__pending != None:
+			(pending_addr, pending_data) = self.__pending
+			if pending_addr + len(pending_data) == addr:
+				(addr, data) = (pending_addr, pending_data + data)
+			else:
+				self.__page(pending_addr, pending_data)
+			self.__pending = None
+
+		while len(data) > 0:
+			size = self.__page_size - (addr % self.__page_size)
+			if len(data) < size:
+				self.__pending = (addr, data)
+				break
+			self.__page(addr, data[:size])
+			(addr, data) = (addr + size, data[size:])
+
+	def close(self):
+		"""Write the index, the underlying file is left open."""
+
+		if self.__pending != None:
+			self.__page(*self.__pending)
+			self.__pending = None
+
+		offset = self.__offset
+		self.__write(''.join(self.__index))
+		self.__write(struct.pack(
+				'<II8s',
+				offset,
+				len(self.__index),
+				DUMP_MAGIC
+				))
+
+class DumpFile:
+	"""Class for loading a sparse flash dump."""
+
+	def __init__(self, file):
+		self.__file = file
+		self.__pages = list()
+		self.__load()
+
+	def __load(self):
+		"""For internal use ONLY!"""
+
+		data = self.__file.read()
+
+		# Header and trailer.
+		try:
+			(magic, version, self.__page_size) = struct.unpack(
+					'<8sBH', data[:11]
+					)
+			(offset, count, trailer) = struct.unpack('<II8s', data[-16:])
+		except struct.error:
+			raise DumpException('Flash dump too short (%d).' % len(data))
+
+		if magic != DUMP_MAGIC or trailer != DUMP_MAGIC:
+			raise DumpException('Not a flash dump.')
+
+		if version != DUMP_VERSION:
+			raise DumpException('Unsupported flash dump version (%d).' % version)
+
+		if offset + 34*count != len(data) - 16:
+			raise DumpException('Invalid flash dump index.')
+
+		# Pages.
+		for i in range(offset, offset + 34*count, 34):
+			(addr, start, size, length, digest) = struct.unpack(
+					'<IIIH20s', data[i:i+34]
+					)
+			try:
+				page = zlib.decompress(data[start:start+size])
+			except zlib.error:
+				raise DumpException('Corrupt page 0x%06x in flash dump.' % addr)
+
+			if len(page) != length or hashlib.sha1(page).digest() != digest:
+				raise DumpException('Corrupt page 0x%06x in flash dump.' % addr)
+
+			self.__pages.append((addr, page))
+
+	def pages(self):
+		"""The non-blank pages, (address, data), in dump order."""
+
+		return self.__pages
+
+	def segments(self):
+		"""The pages merged into consecutive segments, (address, data)."""
+
+		return segments_merge(self.__pages)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""ELF image loader, the PT_LOAD segments of an executable."""
+
+import struct
+from Segments import segments_merge
+
+ELF_MAGIC = '\x7fELF'
+
+class ElfException(Exception):
+	"""Base class for ELF exceptions."""
+
+class ElfFile:
+	"""Class for loading the PT_LOAD segments of an ELF file.
+
+	Segments are placed at their physical (load) address, which is where
+	initialised data has to be flashed for the startup code to find it."""
+
+	def __init__(self, file):
+		self.__data = file.read()
+		self.__segments = list()
+		self.__load()
+		self.__segments = segments_merge(self.__segments)
+		self.__data = None
+
+	def __load(self):
+		"""For internal use ONLY!"""
+
+		data = self.__data
+		if data[:4] != ELF_MAGIC:
+			raise ElfException('Not an ELF file.')
+
+		# Class (32/64-bit) and data encoding (endianess).
+		try:
+			(elf_class, encoding) = struct.unpack('BB', data[4:6])
+		except struct.error:
+			raise ElfException('ELF file too short (%d).' % len(data))
+
+		if encoding == 1:
+			endian = '<'
+		elif encoding == 2:
+			endian = '>'
+		else:
+			raise ElfException('Invalid ELF data encoding (%d).' % encoding)
+
+		if elf_class == 1:
+			(header, ph_fmt) = (endian + 'HHIIIIIHHHHHH', endian + 'IIIIIIII')
+		elif elf_class == 2:
+			(header, ph_fmt) = (endian + 'HHIQQQIHHHHHH', endian + 'IIQQQQQQ')
+		else:
+			raise ElfException('Invalid ELF class (%d).' % elf_class)
+
+		try:
+			fields = struct.unpack(header, data[16:16+struct.calcsize(header)])
+		except struct.error:
+			raise ElfException('ELF file too short (%d).' % len(data))
+		(ph_off, ph_size, ph_num) = (fields[4], fields[8], fields[9])
+
+		if ph_num != 0 and ph_size < struct.calcsize(ph_fmt):
+			raise ElfException('Invalid ELF program header size (%d).' % ph_size)
+
+		for i in range(ph_num):
+			offset = ph_off + i*ph_size
+			try:
+				ph = struct.unpack(ph_fmt, data[offset:offset+struct.calcsize(ph_fmt)])
+			except struct.error:
+				raise ElfException('ELF program header %d out of range.' % i)
+
+			# The field order differs between the classes.
+			if elf_class == 1:
+				(p_type, p_offset, p_paddr, p_filesz) = (ph[0], ph[1], ph[3], ph[4])
+			else:
+				(p_type, p_offset, p_paddr, p_filesz) = (ph[0], ph[2], ph[4], ph[5])
+
+			# Only PT_LOAD segments with content in the file.
+			if p_type != 1 or p_filesz == 0:
+				continue
+
+			if p_offset + p_filesz > len(data):
+				raise ElfException('ELF segment %d out of range.' % i)
+
+			self.__segments.append((p_paddr, data[p_offset:p_offset+p_filesz]))
+
+		if len(self.__segments) == 0:
+			raise ElfException('ELF file contained no loadable segments.')
+
+	def segments(self):
+		return self.__segments
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Intel HEX parser."""
+
+import binascii
+from Segments import segments_merge
+
+class IHexException(Exception):
+	"""Base class for Intel HEX exceptions."""
+
+class IHexFile:
+	"""Class for parsing an Intel HEX file."""
+
+	def __init__(self, file):
+		self.__file = file
+		self.__segments = dict()
+		self.__load()
+		self.__segments = segments_merge(self.__segments.items())
+
+	def __record(self, line, base):
+		"""For internal use ONLY!"""
+
+		if line[:1] != ':':
+			raise IHexException('Invalid record found.')
+
+		try:
+			record = bytearray(binascii.unhexlify(line[1:]))
+		except (TypeError, binascii.Error):
+			raise IHexException('Invalid hex digits in record.')
+
+		if len(record) < 5 or len(record) != record[0] + 5:
+			raise IHexException('Invalid length in record.')
+
+		if (sum(record) & 0xff) != 0:
+			raise IHexException('Invalid checksum in record.')
+
+		(size, addr, record_type) = (record[0], (record[1] << 8) | record[2], record[3])
+		data = record[4:-1]
+
+		# Data
+		if record_type == 0x00:
+			addr += base
+			if addr in self.__segments:
+				raise IHexException('Duplicate address in Intel HEX file.')
+			self.__segments[addr] = str(data)
+
+		# Extended segment address, extended linear address.
+		elif record_type in (0x02, 0x04):
+			if size != 2:
+				raise IHexException('Invalid extended address record.')
+			if record_type == 0x02:
+				base = ((data[0] << 8) | data[1]) << 4
+			else:
+				base = ((data[0] << 8) | data[1]) << 16
+
+		# Start addresses are of no interest when flashing.
+		elif not record_type in (0x01, 0x03, 0x05):
+			raise IHexException('Invalid record type: %02x.' % record_type)
+
+		return (record_type, base)
+
+	def __load(self):
+		"""For internal use ONLY!"""
+
+		base = 0
+		line_number = 0
+		for line in self.__file:
+			line_number += 1
+			line = line.rstrip('\r\n')
+			if len(line) == 0:
+				continue
+
+			try:
+				(record_type, base) = self.__record(line, base)
+			except IHexException, (error):
+				raise IHexException('Line %d: %s' % (line_number, error))
+
+			# End of file record.
+			if record_type == 0x01:
+				break
+
+		if len(self.__segments) == 0:
+			raise IHexException('Intel HEX file contained no data segments.')
+
+	def segments(self):
+		return self.__segments
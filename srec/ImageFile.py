@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Flash image loading, picking the loader from the file format."""
+
+from SRecFile import SRecFile
+from IHexFile import IHexFile
+from ElfFile import ElfFile, ELF_MAGIC
+from BinFile import BinFile
+from DumpFile import DumpFile, DUMP_MAGIC
+from SharedImage import SharedImage, SHARED_MAGIC
+
+IMAGE_FORMATS = ['auto', 'srec', 'ihex', 'elf', 'bin', 'dump', 'shared']
+
+class ImageException(Exception):
+	"""Base class for image loading exceptions."""
+
+def image_format(path):
+	"""Guess the format of an image file from its content."""
+
+	file = open(path, 'rb')
+	try:
+		head = file.read(8)
+	finally:
+		file.close()
+
+	if head[:4] == ELF_MAGIC:
+		return 'elf'
+	if head == DUMP_MAGIC:
+		return 'dump'
+	if head == SHARED_MAGIC:
+		return 'shared'
+	if head[:1] == ':':
+		return 'ihex'
+	if head[:1] == 'S' and head[1:2].isdigit():
+		return 'srec'
+
+	# Raw binary can not be recognised by content.
+	if path.lower().endswith('.bin'):
+		return 'bin'
+
+	raise ImageException(
+			'Unable to determine the format of \'%s\', please specify it.' % path
+			)
+
+def image_open(path, format='auto', base=0, jobs=1):
+	"""Load an image file, returns an object with segments()."""
+
+	if not format in IMAGE_FORMATS:
+		raise ImageException('Invalid image format \'%s\'.' % format)
+
+	if format == 'auto':
+		format = image_format(path)
+
+	# The S-Record parser and shared images memory map the file
+	# themselves.
+	if format == 'srec':
+		return SRecFile(path, jobs)
+	if format == 'shared':
+		return SharedImage(path)
+
+	if format == 'ihex':
+		mode = 'r'
+	else:
+		mode = 'rb'
+
+	file = open(path, mode)
+	try:
+		if format == 'ihex':
+			return IHexFile(file)
+		elif format == 'elf':
+			return ElfFile(file)
+		elif format == 'bin':
+			return BinFile(file, base)
+		else:
+			return DumpFile(file)
+	finally:
+		file.close()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""Several image files combined into one image.
+
+A manifest lists the images, one per line:
+
+	path [format [base address]]
+
+Empty lines and lines starting with '#' are ignored, relative paths are
+relative to the manifest."""
+
+import os
+from Segments import segments_merge, segments_overlap
+from ImageFile import ImageException, image_open, IMAGE_FORMATS
+
+def manifest_load(path):
+	"""Load a manifest, returns a list of (path, format, base)."""
+
+	images = list()
+	file = open(path, 'r')
+	try:
+		line_number = 0
+		for line in file:
+			line_number += 1
+			fields = line.split()
+			if len(fields) == 0 or fields[0].startswith('#'):
+				continue
+
+			if len(fields) > 3:
+				raise ImageException('Line %d: Too many fields in manifest.' % line_number)
+
+			image = os.path.join(os.path.dirname(path), fields[0])
+			format = 'auto'
+			if len(fields) > 1:
+				format = fields[1]
+				if not format in IMAGE_FORMATS:
+					raise ImageException(
+							'Line %d: Invalid image format \'%s\'.' % (line_number, format)
+							)
+			base = 0
+			if len(fields) > 2:
+				try:
+					base = int(fields[2], 0)
+				except ValueError:
+					raise ImageException(
+							'Line %d: Invalid base address \'%s\'.' % (line_number, fields[2])
+							)
+
+			images.append((image, format, base))
+	finally:
+		file.close()
+
+	if len(images) == 0:
+		raise ImageException('Manifest \'%s\' lists no images.' % path)
+
+	return images
+
+class ImageSet:
+	"""Class for combining several image files into one image.
+
+	The images, a list of (path, format, base), may not overlap."""
+
+	def __init__(self, images, jobs=1):
+		self.__images = images
+		self.__jobs = jobs
+		self.__segments = None
+		self.__load()
+
+	def __load(self):
+		"""For internal use ONLY!"""
+
+		loaded = [
+				image_open(path, format, base, self.__jobs).segments()
+				for (path, format, base) in self.__images
+				]
+
+		overlap = segments_overlap(loaded)
+		if overlap != None:
+			(addr, image, other) = overlap
+			if image == other:
+				raise ImageException(
+						'Overlapping data at 0x%06x in \'%s\'.' %
+						(addr, self.__images[image][0])
+						)
+			raise ImageException(
+					'\'%s\' and \'%s\' overlap at 0x%06x.' %
+					(self.__images[image][0], self.__images[other][0], addr)
+					)
+
+		self.__segments = segments_merge([i for j in loaded for i in j])
+
+	def segments(self):
+		return self.__segments
@@ -21,91 +21,233 @@
 #
 
 
-import sys, struct, timeit, array
+import os, sys, struct, mmap, binascii, multiprocessing
+from Segments import segments_merge
 
 """Motorola S-Record parser."""
 
+# Files smaller than this are always parsed serially, starting the worker
+# processes would take longer than parsing the file. Larger files are
+# only parsed in parallel when asked for: on a single cpu two processes
+# took 1.24s for a 10MB file against 0.84s serially.
+PARALLEL_SIZE = 4 << 20
+
 class SRecException(Exception):
 	"""Base class for S-Record exception."""
 
-class SRecFile:
-	"""Class for parsing a S-Record file."""
+# The record decoding is done by plain functions rather than methods, the
+# worker processes of the parallel parser must be able to use them.
 
-	def __init__(self, file):
-		self.__file = file
-		self.__segments = dict()
-		self.__line_ending = None
-		self.__load()
-		self.__merge()
-		self.__convert()
+def _decode_error(addr_len, line):
+	"""For internal use ONLY!"""
 
-	def __make_segment(self, addr_len, line):
-		"""For internal use ONLY!"""
+	try:
+		size = int(line[:2], 16)
+	except ValueError:
+		raise SRecException('Invalid length entry in S-Record.')
+
+	if len(line) != (2*size+2):
+		raise SRecException('Invalid length in S-Record.')
 
-		lint = int
-		llen = len
-		# Make sure we have at least the smallest possible entry(I think?)
-		if llen(line) < (6 + 2*addr_len):
-			raise SRecException('S-Record too short (%d).' % llen(line))
-		
-		# Validate the size entry
+	addr_end = 2 + 2*addr_len
+	for (lower, upper, entry) in (
+			(2, addr_end, 'address'),
+			(addr_end, -2, 'data'),
+			(-2, len(line), 'checksum')
+			):
+		try:
+			binascii.unhexlify(line[lower:upper])
+		except (TypeError, binascii.Error):
+			raise SRecException('Invalid %s entry in S-Record.' % entry)
+
+	raise SRecException('Invalid data entry in S-Record.')
+
+def _decode(addr_len, buf, start, end):
+	"""For internal use ONLY!"""
+
+	llen = end - start
+	# Make sure we have at least the length, address and checksum.
+	if llen < (4 + 2*addr_len):
+		raise SRecException('S-Record too short (%d).' % llen)
+
+	# Address, depends on type
+	if not addr_len in (2,3,4):
+		raise SRecException('Invalid address length of S-Record.')
+
+	# Decode the whole record in one go, only if that fails do we
+	# bother finding out which entry is broken.
+	try:
+		record = binascii.unhexlify(buffer(buf, start, llen))
+	except (TypeError, binascii.Error):
+		_decode_error(addr_len, buf[start:end])
+
+	# Validate the size entry
+	if llen != (2*ord(record[0])+2):
+		raise SRecException('Invalid length in S-Record.')
+
+	# Checksum, the ones' complement of the sum of the other bytes
+	# so the sum of all bytes is always 0xff.
+	if (sum(bytearray(record)) & 0xff) != 0xff:
+		raise SRecException('Invalid checksum in S-Record.')
+
+	addr = struct.unpack(
+			'>I',
+			'\x00'*(4-addr_len) + record[1:1+addr_len]
+			)[0]
+
+	return (addr, record[1+addr_len:-1])
+
+def _record(line_number, buf, start, end):
+	"""For internal use ONLY!"""
+
+	try:
+		if end - start < 2 or buf[start] != 'S':
+			raise SRecException('Invalid record found')
+
+		record_type = buf[start+1]
+
+		# Header record, the content is of no interest but it is
+		# validated just as any other record.
+		if record_type == '0':
+			if line_number != 0:
+				raise SRecException('Header record not on the first line.')
+			_decode(2, buf, start+2, end)
+
+		# Regular data record, strip the 'S' and section type then
+		# decode it.
+		elif record_type in ('1', '2', '3'):
+			addr_len = int(record_type)+1
+
+			# Data records without any data are of no use.
+			if (end - start - 2) < (6 + 2*addr_len):
+				raise SRecException('S-Record too short (%d).' % (end - start - 2))
+
+			return _decode(addr_len, buf, start+2, end)
+
+		# Only record types we accept right now.
+		elif not record_type in ('7', '8', '9'):
+			raise SRecException(
+					'Invalid record type: \'%s\'.' % buf[start:start+2]
+					)
+
+	except SRecException, (error):
+		raise SRecException('Line %d: %s' % (line_number+1, error))
+
+	return None
+
+def _line_ending(buf):
+	"""For internal use ONLY!"""
+
+	# Determine the line ending of the file from the first line.
+	cr = buf.find('\r')
+	lf = buf.find('\n')
+	if lf != -1 and cr == lf-1:
+		return '\r\n'
+	elif cr != -1 and (lf == -1 or cr < lf):
+		return '\r'
+	elif lf != -1:
+		return '\n'
+	return ''
+
+def _records(buf, start, end, line_number, line_ending):
+	"""For internal use ONLY!"""
+
+	# Any of these within a line, or ending it, means that the line
+	# endings are mixed.
+	if line_ending == '\n':
+		(stray, stray_end) = ('\r\n', 1)
+	else:
+		(stray, stray_end) = ('\n', 0)
+
+	find = buf.find
+	chunk_end = end
+	while start < chunk_end:
+		if line_ending != '':
+			end = find(line_ending, start, chunk_end)
+			if end == -1:
+				end = chunk_end
+		else:
+			end = chunk_end
+
+		if find(stray, start, end+stray_end) != -1:
+			raise SRecException(
+					'Line %d: Inconsistant line endings in S-Record.' %
+					(line_number+1)
+					)
+
+		record = _record(line_number, buf, start, end)
+		if record != None:
+			yield (line_number, record[0], record[1])
+		start = end + len(line_ending)
+		line_number += 1
+
+def _load_chunk(args):
+	"""For internal use ONLY!"""
+
+	(path, start, end, line_number, line_ending) = args
+
+	file = open(path, 'rb')
+	try:
+		buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+	finally:
+		file.close()
+
+	# Hand back what was decoded up to the first error, the error itself
+	# is raised once all the records before it have been merged.
+	records = list()
+	try:
 		try:
-			size = lint(line[:2], 16)
-		except:
-			raise SRecException('Invalid length entry in S-Record.')
+			for record in _records(buf, start, end, line_number, line_ending):
+				records.append(record)
+		except SRecException, (error):
+			return (records, str(error))
+	finally:
+		buf.close()
 
-		if llen(line) != (2*size+2):
-			raise SRecException('Invalid length in S-Record.')
+	return (records, None)
 
-		# Address, depends on type
-		if not addr_len in (2,3):
-			raise SRecException('Invalid address length of S-Record.')
+class SRecFile:
+	"""Class for parsing a S-Record file.
 
-		addr_start = 2
-		addr_end = addr_start + 2*addr_len
+	The file is either a file object (or any sequence of lines) or the
+	path of the file, in which case it is memory mapped and the records
+	are decoded straight from the mapping. Large files given by path are
+	parsed by a pool of jobs processes (0 for one per cpu)."""
 
-		try:
-			addr = lint(line[addr_start:addr_end], 16)
-		except:
-			raise SRecException('Invalid address entry in S-Record.')
+	def __init__(self, file, jobs=1):
+		self.__file = file
+		self.__jobs = jobs
+		self.__segments = dict()
+		self.__line_ending = None
+		if isinstance(file, basestring):
+			self.__load_path()
+		else:
+			self.__load()
+		self.__merge()
 
-		# Data
-		data = list()
-		try:
-			for i in range(0,2*(size-addr_len-1),2):
-				data.append(lint(line[addr_end+i:addr_end+i+2], 16))
-		except:
-			raise SRecException('Invalid data entry in S-Record.')
+	def __make_segment(self, line_number, addr, data):
+		"""For internal use ONLY!"""
 
-		# Checksum
-		try:
-			csum = lint(line[-2:], 16)
-		except:
-			raise SRecException('Invalid checksum entry in S-Record.')
-
-		tmp = addr
-		csum_calc = size
-		csum_calc += sum(data)
-		#csum_calc += sum(struct.unpack("BBBB", struct.pack("I", tmp)))
-		while tmp > 0:
-				csum_calc += tmp & 0xff
-				tmp >>= 8
-		csum_calc = (~csum_calc & 0xff)
-
-		# Debug info...
-		#print('Address: 0x%04x' % addr)
-		#for i in data:
-		#	print('\t0x%02x' % i)
-		#print('Checksum: 0x%02x(0x%02x)' % (csum_calc, csum))
-
-		if csum != csum_calc:
-			raise SRecException('Invalid checksum in S-Record.')
-
-		if self.__segments.has_key(addr):
-			raise SRecException('Duplicate address in S-Record file.')
+		if addr in self.__segments:
+			raise SRecException(
+					'Line %d: Duplicate address in S-Record file.' % (line_number+1)
+					)
 
 		self.__segments[addr] = data
 
+	def __line_ending_of(self, line):
+		"""For internal use ONLY!"""
+
+		# DOS
+		if line[-2:] == '\r\n':
+			return '\r\n'
+		# Linux/Unix or Mac
+		elif line[-1:] in ('\n', '\r'):
+			return line[-1:]
+		# Last line without a line ending
+		else:
+			return ''
+
 	def __load(self):
 		"""For internal use ONLY!"""
 
@@ -113,94 +255,101 @@ class SRecFile:
 		for line in self.__file:
 
 			# Determine the line ending of the file
+			line_ending = self.__line_ending_of(line)
 			if self.__line_ending == None:
-				# DOS
-				if line[-2:] == '\r\n':
-					self.__line_ending = '\r\n'
-				# Linux/Unix
-				elif line[-1:] == '\r':
-					self.__line_ending = '\r'
-				# Mac
-				elif line[-1:] != '\n':
-					self.__line_ending = '\n'
-				else:
-					raise SRecException('Invalid line ending in S-Record.')
-
-			# Make sure it's consistant.
-			else:
-				if self.__line_ending != line[-len(self.__line_ending):]:
-					raise SRecException(
-							'Inconsistant line endings in S-Record.'
-							)
-
-			if line[0] != 'S':
-				raise SRecException('Invalid record found')
-			
-			# Header record
-			if line[1] == '0':
-				if line_number != 0:
-					raise SRecException(
-							'Expected header but got: %c .' % line[1]
-							)
-
-			# Regular data record.
-			elif line[1] in ('1', '2'):
-				# Strip line ending and the 'S' and section type then pass
-				# To the make segment function for further processing.
-				try:
-					addr_len = int(line[1])+1
-				except:
-					raise SRecException('BUG!!!')
-
-				self.__make_segment(addr_len, line[2:-len(self.__line_ending)])
-
-			# Only record types we accept right now.
-			elif not line[1] in ('8', '9'):
-				raise SRecException('Invalid record type: \'%s\'.' % line[:2])
+				self.__line_ending = line_ending
 
+			# Make sure it's consistant, only the last line may lack one.
+			elif line_ending != '' and line_ending != self.__line_ending:
+				raise SRecException(
+						'Line %d: Inconsistant line endings in S-Record.' %
+						(line_number+1)
+						)
+
+			record = _record(line_number, line, 0, len(line)-len(line_ending))
+			if record != None:
+				self.__make_segment(line_number, *record)
 			line_number += 1
 
 		# Make sure there where at least one data record.
 		if len(self.__segments) == 0:
 			raise SRecException('S-Record file contained no data segments.')
 
-	def __merge(self):
+	def __load_path(self):
 		"""For internal use ONLY!"""
 
-		# Sort on the address, ascending
-		segments = self.__segments.items()
-		segments.sort(key=lambda x: x[0])
+		file = open(self.__file, 'rb')
+		try:
+			if os.fstat(file.fileno()).st_size == 0:
+				raise SRecException('S-Record file contained no data segments.')
+			buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		finally:
+			file.close()
+
+		try:
+			self.__line_ending = _line_ending(buf)
 
-		# Merge all consecutive segments.
-		cur = segments[0]
-		merged = list()
-		for i in segments[1:]:
-			if i[0] == (cur[0] + len(cur[1])):
-				cur = [cur[0],  cur[1] + i[1]]
+			jobs = self.__jobs
+			if jobs == 0:
+				jobs = multiprocessing.cpu_count()
+
+			if jobs > 1 and len(buf) >= PARALLEL_SIZE and self.__line_ending != '':
+				self.__load_parallel(buf, jobs)
 			else:
-				merged.append(cur)
-				cur = i
-		merged.append(cur)
-		self.__segments = merged
+				make_segment = self.__make_segment
+				for record in _records(buf, 0, len(buf), 0, self.__line_ending):
+					make_segment(*record)
+		finally:
+			buf.close()
+
+		# Make sure there where at least one data record.
+		if len(self.__segments) == 0:
+			raise SRecException('S-Record file contained no data segments.')
 
-	def __convert(self):
+	def __load_parallel(self, buf, jobs):
 		"""For internal use ONLY!"""
 
-		# Convert each segment to sequence of bytes.
-		converted = list()
-		for i in self.__segments:
-			try:
-				tmp = struct.pack(
-						'B'*len(i[1]),
-						*i[1]
-						)
-				converted.append((i[0], tmp))
-			except:
-				raise SRecException(
-						'Internal parser error, entry out of range.'
-						)
+		# Split the file into line aligned chunks, a few per job to keep
+		# all of them busy until the end.
+		line_ending = self.__line_ending
+		count = jobs * 4
+		chunks = list()
+		(start, line_number) = (0, 0)
+		while start < len(buf):
+			end = buf.find(line_ending, start + len(buf)/count)
+			if end == -1:
+				end = len(buf)
+			else:
+				end += len(line_ending)
+			chunks.append((self.__file, start, end, line_number, line_ending))
+
+			# Count the lines of the chunk, a piece at a time. The last
+			# character of the line ending is enough to count them.
+			for i in range(start, end, 1 << 20):
+				line_number += buf[i:min(i + (1 << 20), end)].count(line_ending[-1])
+			start = end
+
+		pool = multiprocessing.Pool(jobs)
+		try:
+			results = pool.map(_load_chunk, chunks)
+		finally:
+			pool.close()
+			pool.join()
+
+		# Merge in file order so that duplicates and errors are reported
+		# just as the serial parser would.
+		make_segment = self.__make_segment
+		for (records, error) in results:
+			for record in records:
+				make_segment(*record)
+			if error != None:
+				raise SRecException(error)
+
+	def __merge(self):
+		"""For internal use ONLY!"""
 
-		self.__segments = converted
+		# Sort on the address and merge all consecutive segments.
+		self.__segments = segments_merge(self.__segments.items())
 
 	def segments(self):
 		return self.__segments
@@ -208,4 +357,4 @@ class SRecFile:
 	def dump_segments(self):
 		for i in self.__segments:
 			print('Address: 0x%04x' % i[0])
-			print('Data: ' + '%02x'*len(i[1]) % tuple(map(ord, i[1])))
+			print('Data: ' + binascii.hexlify(i[1]))
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Random access index for S-Record files.
+
+The index maps address ranges to byte ranges of the S-Record file so that
+a single address range can be loaded without parsing the whole file. It
+is stored next to the file (<file>.idx) and rebuilt whenever the size or
+modification time of the file no longer match."""
+
+import os, struct, mmap
+from SRecFile import SRecFile, SRecException, _line_ending
+
+INDEX_MAGIC = 'SM16SIDX'
+INDEX_VERSION = 2
+
+class SRecIndex:
+	"""Class for random access to a S-Record file."""
+
+	def __init__(self, path, group=64, index_path=None):
+		self.__path = path
+		self.__group = group
+		if index_path == None:
+			index_path = path + '.idx'
+		self.__index_path = index_path
+		self.__entries = None
+
+		stat = os.stat(path)
+		self.__stamp = (stat.st_size, stat.st_mtime)
+
+		if not self.__load():
+			self.__build()
+			self.__save()
+
+	def __load(self):
+		"""For internal use ONLY!"""
+
+		try:
+			file = open(self.__index_path, 'rb')
+			try:
+				data = file.read()
+			finally:
+				file.close()
+		except IOError:
+			return False
+
+		try:
+			(magic, version, size, mtime, count) = struct.unpack(
+					'<8sBQdI', data[:29]
+					)
+		except struct.error:
+			return False
+
+		# Stale or foreign index, rebuild it.
+		if magic != INDEX_MAGIC or version != INDEX_VERSION:
+			return False
+		if (size, mtime) != self.__stamp or len(data) != 29 + 20*count:
+			return False
+
+		self.__entries = [
+				struct.unpack('<IIQI', data[i:i+20])
+				for i in range(29, len(data), 20)
+				]
+		return True
+
+	def __save(self):
+		"""For internal use ONLY!"""
+
+		data = [struct.pack(
+				'<8sBQdI',
+				INDEX_MAGIC,
+				INDEX_VERSION,
+				self.__stamp[0],
+				self.__stamp[1],
+				len(self.__entries)
+				)]
+		for i in self.__entries:
+			data.append(struct.pack('<IIQI', *i))
+
+		# The index is only a cache, not being able to save it (read only
+		# directory etc.) is not an error.
+		try:
+			file = open(self.__index_path, 'wb')
+			try:
+				file.write(''.join(data))
+			finally:
+				file.close()
+		except IOError:
+			pass
+
+	def __build(self):
+		"""For internal use ONLY!"""
+
+		self.__entries = list()
+		(lower, upper, start, records) = (None, None, None, 0)
+
+		file = open(self.__path, 'rb')
+		try:
+			if os.fstat(file.fileno()).st_size == 0:
+				return
+			buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		finally:
+			file.close()
+
+		# Same line endings as the parser, CR only files included.
+		offset = 0
+		try:
+			line_ending = _line_ending(buf)
+			while offset < len(buf):
+				end = -1
+				if line_ending != '':
+					end = buf.find(line_ending, offset)
+				if end == -1:
+					end = len(buf)
+				else:
+					end += len(line_ending)
+				line = buf[offset:end]
+
+				# Only data records are indexed, the rest are of no use
+				# when loading a range.
+				if line[:2] in ('S1', 'S2', 'S3'):
+					addr_len = int(line[1]) + 1
+					try:
+						size = int(line[2:4], 16) - addr_len - 1
+						addr = int(line[4:4+2*addr_len], 16)
+					except ValueError:
+						raise SRecException('Invalid data record at offset %d.' % offset)
+
+					if records == 0:
+						(lower, upper, start) = (addr, addr + size, offset)
+					else:
+						lower = min(lower, addr)
+						upper = max(upper, addr + size)
+					records += 1
+					offset += len(line)
+
+					if records == self.__group:
+						self.__entries.append((lower, upper, start, offset - start))
+						records = 0
+
+				else:
+					# Groups never span other records.
+					if records != 0:
+						self.__entries.append((lower, upper, start, offset - start))
+						records = 0
+					offset += len(line)
+		finally:
+			buf.close()
+
+		if records != 0:
+			self.__entries.append((lower, upper, start, offset - start))
+
+	def ranges(self):
+		"""The indexed ranges, (lower, upper, offset, length)."""
+
+		return self.__entries
+
+	def segments(self, addr, size):
+		"""Load the segments (address, data) within the address range."""
+
+		if size <= 0:
+			raise SRecException('Invalid range size (%d).' % size)
+
+		# Read the records of all groups that overlap the range.
+		lines = list()
+		file = open(self.__path, 'rb')
+		try:
+			for (lower, upper, offset, length) in self.__entries:
+				if lower < addr + size and upper > addr:
+					file.seek(offset)
+					lines.extend(file.read(length).splitlines(True))
+		finally:
+			file.close()
+
+		# Parse them and cut away anything outside the range.
+		segments = list()
+		if len(lines) != 0:
+			for (lower, data) in SRecFile(lines).segments():
+				upper = lower + len(data)
+				if lower < addr + size and upper > addr:
+					start = max(lower, addr)
+					end = min(upper, addr + size)
+					segments.append((start, data[start-lower:end-lower]))
+
+		if len(segments) == 0:
+			raise SRecException(
+					'No S-Record data within 0x%06x-0x%06x.' % (addr, addr + size - 1)
+					)
+
+		return segments
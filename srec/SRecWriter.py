@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Motorola S-Record writer."""
+
+import struct, binascii
+from SRecFile import SRecException
+
+class SRecWriter:
+	"""Class for writing a S-Record file."""
+
+	def __init__(self, file, addr_len=3, record_size=32, header='',
+			line_ending='\r\n'):
+		if not addr_len in (2, 3, 4):
+			raise SRecException('Invalid address length of S-Record.')
+
+		# The count byte covers the address, data and checksum.
+		if record_size < 1 or record_size > (0xff - addr_len - 1):
+			raise SRecException('Invalid S-Record size (%d).' % record_size)
+
+		self.__file = file
+		self.__addr_len = addr_len
+		self.__addr_max = (1 << (8*addr_len)) - 1
+		self.__record_size = record_size
+		self.__line_ending = line_ending
+
+		# Data record type and the matching termination record type.
+		self.__data_type = 'S%d' % (addr_len - 1)
+		self.__end_type = 'S%d' % (11 - addr_len)
+
+		self.__file.write(self.__record('S0', 2, 0, header))
+
+	def __record(self, record_type, addr_len, addr, data):
+		"""For internal use ONLY!"""
+
+		record = struct.pack('>BI', addr_len + len(data) + 1, addr)
+		record = record[:1] + record[5-addr_len:] + data
+		csum = ~sum(bytearray(record)) & 0xff
+		return '%s%s%02X%s' % (
+				record_type,
+				binascii.hexlify(record).upper(),
+				csum,
+				self.__line_ending
+				)
+
+	def write(self, addr, data):
+		"""Write data at the address as one or more data records."""
+
+		if addr < 0 or (addr + len(data) - 1) > self.__addr_max:
+			raise SRecException(
+					'Address 0x%x out of range for %s records.' % (addr, self.__data_type)
+					)
+
+		# Format all records first and write them in one go.
+		size = self.__record_size
+		self.__file.write(''.join([
+				self.__record(self.__data_type, self.__addr_len, addr + i, data[i:i+size])
+				for i in range(0, len(data), size)
+				]))
+
+	def close(self, entry=0):
+		"""Write the termination record, the underlying file is left open."""
+
+		self.__file.write(self.__record(self.__end_type, self.__addr_len, entry, ''))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Helpers for (address, data) segment lists."""
+
+def segments_merge(segments):
+	"""Sort segments on address and merge the consecutive ones."""
+
+	segments = sorted(segments, key=lambda x: x[0])
+	if len(segments) == 0:
+		return list()
+
+	merged = list()
+	(addr, data) = (segments[0][0], [segments[0][1]])
+	end = addr + len(segments[0][1])
+	for i in segments[1:]:
+		if i[0] != end:
+			merged.append((addr, _segment_join(data)))
+			(addr, data) = (i[0], list())
+		data.append(i[1])
+		end = i[0] + len(i[1])
+	merged.append((addr, _segment_join(data)))
+
+	return merged
+
+def _segment_join(data):
+	"""For internal use ONLY!"""
+
+	# The data may be buffers, from a shared image, which join does
+	# not take. A lone buffer is kept as it is to avoid the copy.
+	if len(data) == 1:
+		return data[0]
+	return ''.join([str(i) for i in data])
+
+def segments_pages(segments, page_size=256):
+	"""Split segments into pages, {page address: data}.
+
+	Bytes of a page not covered by any segment are 0xff, just as in
+	erased flash."""
+
+	blank = '\xff' * page_size
+	pages = dict()
+	for (addr, data) in segments:
+		offset = 0
+		while offset < len(data):
+			page = (addr + offset) - ((addr + offset) % page_size)
+			start = addr + offset - page
+			size = min(page_size - start, len(data) - offset)
+			if size == page_size and not page in pages:
+				pages[page] = data[offset:offset+size]
+			else:
+				tmp = pages.get(page, blank)
+				pages[page] = tmp[:start] + data[offset:offset+size] + tmp[start+size:]
+			offset += size
+
+	return pages
+
+def segments_overlap(images):
+	"""Find the first overlap between lists of segments, one per image.
+
+	Returns (address, image, other image), the images being indices
+	into the list, or None. All segments are sorted once and swept in
+	address order so this stays cheap for images with many segments."""
+
+	spans = sorted([
+			(addr, addr + len(data), image)
+			for (image, segments) in enumerate(images)
+			for (addr, data) in segments
+			if len(data) > 0
+			])
+
+	(end, owner) = (None, None)
+	for (lower, upper, image) in spans:
+		if end != None and lower < end:
+			return (lower, owner, image)
+		if end == None or upper > end:
+			(end, owner) = (upper, image)
+
+	return None
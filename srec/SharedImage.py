@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""Parsed flash images shared between processes.
+
+An image is parsed once and published to a file, which any number of
+processes then memory map read-only. The segments are buffers into the
+mapping, so the data is never copied and the page cache holds a single
+copy however many processes use it. The layout is:
+
+	header    magic (8), version (1), number of segments (4), padding (3)
+	segments  address (4), offset (8), size (4) for each segment
+	data      the data of each segment, 8 byte aligned
+
+All integers are little endian. /dev/shm is a good place for the file."""
+
+import os, struct, mmap
+
+SHARED_MAGIC = 'SM16SIMG'
+SHARED_VERSION = 1
+
+class SharedImageException(Exception):
+	"""Base class for shared image exceptions."""
+
+def image_publish(segments, path):
+	"""Publish segments (address, data) to a shared image file.
+
+	The file is written under a temporary name and renamed, so no one
+	ever attaches to a partly written image."""
+
+	offset = 16 + 16*len(segments)
+	table = list()
+	for (addr, data) in segments:
+		offset = (offset + 7) & ~7
+		table.append(struct.pack('<IQI', addr, offset, len(data)))
+		offset += len(data)
+
+	tmp = '%s.%d.tmp' % (path, os.getpid())
+	file = open(tmp, 'wb')
+	try:
+		try:
+			file.write(struct.pack('<8sBI3x', SHARED_MAGIC, SHARED_VERSION, len(segments)))
+			file.write(''.join(table))
+			for (addr, data) in segments:
+				file.write('\x00' * (-file.tell() & 7))
+				file.write(data)
+		finally:
+			file.close()
+		os.rename(tmp, path)
+	except:
+		if os.path.exists(tmp):
+			os.unlink(tmp)
+		raise
+
+class SharedImage:
+	"""Class attaching to a shared image file."""
+
+	def __init__(self, path):
+		self.__segments = list()
+		self.__mmap = None
+
+		file = open(path, 'rb')
+		try:
+			size = os.fstat(file.fileno()).st_size
+			if size < 16:
+				raise SharedImageException('Shared image too short (%d).' % size)
+			self.__mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		finally:
+			file.close()
+
+		try:
+			self.__load()
+		except:
+			self.close()
+			raise
+
+	def __load(self):
+		"""For internal use ONLY!"""
+
+		(magic, version, count) = struct.unpack('<8sBI3x', self.__mmap[:16])
+		if magic != SHARED_MAGIC:
+			raise SharedImageException('Not a shared image.')
+		if version != SHARED_VERSION:
+			raise SharedImageException('Unsupported shared image version (%d).' % version)
+		if 16 + 16*count > len(self.__mmap):
+			raise SharedImageException('Invalid shared image segment table.')
+
+		for i in range(16, 16 + 16*count, 16):
+			(addr, offset, size) = struct.unpack('<IQI', self.__mmap[i:i+16])
+			if offset + size > len(self.__mmap):
+				raise SharedImageException('Segment 0x%06x beyond the end of the shared image.' % addr)
+			self.__segments.append((addr, buffer(self.__mmap, offset, size)))
+
+	def segments(self):
+		"""The segments, (address, buffer), the buffers are only valid
+		until the image is closed."""
+
+		return self.__segments
+
+	def close(self):
+		if self.__mmap != None:
+			self.__segments = list()
+			self.__mmap.close()
+			self.__mmap = None
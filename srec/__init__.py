@@ -20,4 +20,14 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+from Segments import *
 from SRecFile import *
+from SRecWriter import *
+from SRecIndex import *
+from IHexFile import *
+from ElfFile import *
+from BinFile import *
+from ImageFile import *
+from ImageSet import *
+from DumpFile import *
+from SharedImage import *
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""Tests of delta flashing against a baseline image.
+
+Run from the top directory with:
+
+	python -m unittest discover -s tests"""
+
+import os, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import m16c, srec
+
+BASELINE = [(0x0f0000, 'a' * 0x200), (0x0f8000, 'b' * 0x100)]
+IMAGE = [
+		(0x0f0000, 'a' * 0x100 + 'c' * 0x100),
+		(0x0f8000, 'b' * 0x100),
+		(0x0fa000, 'd' * 0x100),
+		]
+
+def flasher_open(segments):
+	"""A Flasher, id validated, talking to a PlanDevice holding the
+	segments."""
+
+	device = m16c.PlanDevice(segments)
+	flasher = m16c.Flasher(device, True)
+	flasher.id_validate([0] * 7)
+	return flasher
+
+class DeltaPlanTest(unittest.TestCase):
+	"""Planning, running and spot checking against PlanDevice."""
+
+	def setUp(self):
+		self.plan = m16c.DeltaPlan(BASELINE, IMAGE, m16c.M16C62P_BLOCKS)
+
+	def test_plan(self):
+		# A changed page that was not blank erases its block and every
+		# page of the image in it is written again, a new page in a
+		# blank block is written as it is.
+		self.assertEqual(self.plan.erase(), [(0x0f0000, 0x8000)])
+		self.assertEqual(
+				[page for (page, data) in self.plan.write()],
+				[0x0f0000, 0x0f0100, 0x0fa000]
+				)
+		self.assertEqual(self.plan.unerased(), [0x0fa000])
+
+	def test_unchanged(self):
+		plan = m16c.DeltaPlan(IMAGE, IMAGE, m16c.M16C62P_BLOCKS)
+		self.assertEqual(plan.erase(), [])
+		self.assertEqual(plan.write(), [])
+
+	def test_run(self):
+		flasher = flasher_open(BASELINE)
+		self.plan.run(flasher, 10)
+
+		pages = srec.segments_pages(IMAGE)
+		for page in range(0x0f0000, 0x100000, 0x100):
+			self.assertEqual(flasher.page_read(page), pages.get(page, '\xff' * 256))
+
+	def test_spot_check(self):
+		self.plan.spot_check(flasher_open(BASELINE), 10)
+
+		for (segments, page) in (
+				([], 0x0f0000),
+				(BASELINE + [(0x0fa000, 'e')], 0x0fa000),
+				):
+			try:
+				self.plan.spot_check(flasher_open(segments), 10)
+			except m16c.FlasherException, (error):
+				self.assertEqual(
+						str(error),
+						'Device does not hold the baseline image (page 0x%06x).' % page
+						)
+			else:
+				self.fail('No error from the spot check.')
+
+	def test_outside_blocks(self):
+		try:
+			m16c.DeltaPlan([(0x0e0000, 'a')], [(0x0e0000, 'b')], m16c.M16C62P_BLOCKS)
+		except m16c.FlasherException, (error):
+			self.assertEqual(str(error), 'Page 0x0e0000 is not within any block.')
+		else:
+			self.fail('No error for a page outside the blocks.')
+
+if __name__ == '__main__':
+	unittest.main()
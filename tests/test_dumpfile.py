@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""Tests of sparse flash dumps.
+
+Run from the top directory with:
+
+	python -m unittest discover -s tests"""
+
+import os, sys, shutil, tempfile, unittest, StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import srec
+
+BLANK = '\xff' * 256
+
+def dump(writes, page_size=256):
+	"""Dump the (address, data) writes, returns the dump."""
+
+	file = StringIO.StringIO()
+	writer = srec.DumpWriter(file, page_size)
+	for (addr, data) in writes:
+		writer.write(addr, data)
+	writer.close()
+	return file.getvalue()
+
+def dump_load(data):
+	return srec.DumpFile(StringIO.StringIO(data))
+
+class DumpFileTest(unittest.TestCase):
+	"""Writing dumps and loading them back."""
+
+	def test_round_trip(self):
+		data = 'a' * 256 + BLANK + 'b' * 256
+		loaded = dump_load(dump([(0x0f0000, data), (0x0ff000, 'c' * 256)]))
+
+		# Blank pages are left out.
+		self.assertEqual(loaded.pages(), [
+				(0x0f0000, 'a' * 256),
+				(0x0f0200, 'b' * 256),
+				(0x0ff000, 'c' * 256),
+				])
+		self.assertEqual(loaded.segments(), [
+				(0x0f0000, 'a' * 256),
+				(0x0f0200, 'b' * 256),
+				(0x0ff000, 'c' * 256),
+				])
+
+	def test_partial_writes(self):
+		# Consecutive writes not on page boundaries end up as whole pages,
+		# a gap flushes what is pending.
+		loaded = dump_load(dump([
+				(0x0f0000, 'a' * 100),
+				(0x0f0064, 'b' * 300),
+				(0x0f8010, 'c' * 16),
+				]))
+		self.assertEqual(loaded.pages(), [
+				(0x0f0000, 'a' * 100 + 'b' * 156),
+				(0x0f0100, 'b' * 144),
+				(0x0f8010, 'c' * 16),
+				])
+
+	def test_empty(self):
+		self.assertEqual(dump_load(dump([(0x0f0000, BLANK)])).pages(), [])
+
+	def test_page_size(self):
+		loaded = dump_load(dump([(0x1000, 'a' * 1024)], 512))
+		self.assertEqual(loaded.pages(), [(0x1000, 'a' * 512), (0x1200, 'a' * 512)])
+
+	def test_errors(self):
+		data = dump([(0x0f0000, 'a' * 256)])
+		corrupt = data[:11] + chr(ord(data[11]) ^ 0xff) + data[12:]
+		for (data, message) in (
+				('', 'Flash dump too short (0).'),
+				('x' * 32, 'Not a flash dump.'),
+				(data[:-17] + data[-16:], 'Invalid flash dump index.'),
+				(corrupt, 'Corrupt page 0x0f0000 in flash dump.'),
+				):
+			try:
+				dump_load(data)
+			except srec.DumpException, (error):
+				self.assertEqual(str(error), message)
+			else:
+				self.fail('No error for %r.' % data)
+
+	def test_image_open(self):
+		directory = tempfile.mkdtemp()
+		try:
+			path = os.path.join(directory, 'test.dump')
+			file = open(path, 'wb')
+			try:
+				file.write(dump([(0x0f0000, 'a' * 256)]))
+			finally:
+				file.close()
+
+			self.assertEqual(srec.image_format(path), 'dump')
+			self.assertEqual(srec.image_open(path).segments(), [(0x0f0000, 'a' * 256)])
+		finally:
+			shutil.rmtree(directory)
+
+if __name__ == '__main__':
+	unittest.main()
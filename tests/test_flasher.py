@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""Tests of the Flasher against a simulated boot loader.
+
+Run from the top directory with:
+
+	python -m unittest discover -s tests"""
+
+import os, sys, time, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import m16c
+
+BLANK = '\xff' * 256
+
+class FaultyDevice(m16c.PlanDevice):
+	"""PlanDevice cutting chosen replies short, the rest of the reply is
+	left for the next read just as on a real line."""
+
+	def __init__(self, segments=(), baud=9600):
+		m16c.PlanDevice.__init__(self, segments, baud=baud)
+		self.__faults = list()
+		self.__reads = dict()
+		self.__late = (0, 0.0)
+
+	def fault(self, size, count=1, late=0.0):
+		"""Cut the count:th read of size bytes from now in half. The rest
+		keeps arriving for late seconds, a flush until then misses it."""
+
+		self.__faults.append((size, self.__reads.get(size, 0) + count, late))
+
+	def read(self, size=1):
+		self.__reads[size] = self.__reads.get(size, 0) + 1
+		for (fault_size, count, late) in self.__faults:
+			if (fault_size, count) == (size, self.__reads[size]):
+				self.__late = time.time() + late
+				return m16c.PlanDevice.read(self, size / 2)
+		return m16c.PlanDevice.read(self, size)
+
+	def flushInput(self):
+		if time.time() >= self.__late:
+			m16c.PlanDevice.flushInput(self)
+
+def flasher_open(segments=(), baud=9600, **kwargs):
+	"""A Flasher, id validated, talking to a FaultyDevice holding the
+	segments."""
+
+	device = FaultyDevice(segments, baud)
+	flasher = m16c.Flasher(device, True, **kwargs)
+	flasher.id_validate([0] * 7)
+	return (flasher, device)
+
+PAGES = [(0x0f0000, ''.join([chr(i) * 256 for i in range(32)]))]
+
+class FlasherCacheTest(unittest.TestCase):
+	"""The page cache must always agree with the flash."""
+
+	def test_disabled(self):
+		(flasher, device) = flasher_open([(0x0f0000, 'a' * 256)])
+		for i in range(2):
+			self.assertEqual(flasher.page_read(0x0f0000), 'a' * 256)
+		self.assertEqual(flasher.cache_hits(), 0)
+
+	def test_read(self):
+		(flasher, device) = flasher_open([(0x0f0000, 'a' * 256)])
+		flasher.cache_set(16)
+		for i in range(2):
+			self.assertEqual(flasher.page_read(0x0f0010), 'a' * 256)
+		self.assertEqual(flasher.cache_hits(), 1)
+
+	def test_write_unknown_page(self):
+		# Only bits that are set in both remain, the old content has to
+		# be read from the device.
+		(flasher, device) = flasher_open([(0x0f0000, '\x0f' * 256)])
+		flasher.cache_set(16)
+		flasher.page_write(0x0f0000, '\xf0' * 256)
+		self.assertEqual(flasher.page_read(0x0f0000), '\x00' * 256)
+		self.assertEqual(flasher.cache_hits(), 0)
+
+	def test_write_cached_page(self):
+		(flasher, device) = flasher_open([(0x0f0000, '\x0f' * 256)])
+		flasher.cache_set(16)
+		flasher.page_read(0x0f0000)
+		flasher.page_write(0x0f0000, '\x33' * 256)
+		self.assertEqual(flasher.page_read(0x0f0000), '\x03' * 256)
+		self.assertEqual(flasher.cache_hits(), 1)
+
+	def test_write_erased_page(self):
+		(flasher, device) = flasher_open([(0x0f0000, '\x0f' * 256)])
+		flasher.cache_set(256)
+		flasher.block_erase(0x0f0000)
+		self.assertEqual(flasher.page_read(0x0f7f00), BLANK)
+		flasher.page_write(0x0f0000, 'b' * 256)
+		self.assertEqual(flasher.page_read(0x0f0000), 'b' * 256)
+		self.assertEqual(flasher.cache_hits(), 2)
+
+	def test_erase_all(self):
+		(flasher, device) = flasher_open([(0x0f0000, 'a' * 256)])
+		flasher.cache_set(16)
+		flasher.page_read(0x0f0000)
+		flasher.block_erase_all()
+		self.assertEqual(flasher.page_read(0x0f0000), BLANK)
+		self.assertEqual(flasher.cache_hits(), 0)
+
+	def test_least_recently_used(self):
+		(flasher, device) = flasher_open()
+		flasher.cache_set(2)
+		for addr in (0x0f0000, 0x0f0100, 0x0f0000, 0x0f0200):
+			flasher.page_read(addr)
+		self.assertEqual(flasher.cache_hits(), 1)
+
+		# 0x0f0100 was the least recently used and is gone.
+		flasher.page_read(0x0f0000)
+		flasher.page_read(0x0f0100)
+		self.assertEqual(flasher.cache_hits(), 2)
+
+class FlasherRetryTest(unittest.TestCase):
+	"""Failed page reads and writes, with and without retries."""
+
+	def test_read_retry(self):
+		(flasher, device) = flasher_open(PAGES, retries=1, retry_delay=0)
+		device.fault(256)
+		self.assertEqual(flasher.page_read(0x0f0100), '\x01' * 256)
+		self.assertEqual(flasher.retry_count()['page_read'], 1)
+
+		# What was left of the failed read must not be taken for the
+		# next reply.
+		self.assertEqual(flasher.page_read(0x0f0200), '\x02' * 256)
+
+	def test_read_without_retries(self):
+		(flasher, device) = flasher_open(PAGES)
+		device.fault(256)
+		try:
+			flasher.page_read(0x0f0100)
+		except m16c.FlasherException, (error):
+			self.assertEqual(
+					str(error),
+					'Unable to read page: Timeout or insufficient data (128).'
+					)
+		else:
+			self.fail('No error for a failed page read.')
+		self.assertEqual(flasher.retry_count()['page_read'], 0)
+
+	def test_read_retries_exhausted(self):
+		(flasher, device) = flasher_open(PAGES, retries=2, retry_delay=0)
+		for i in range(3):
+			device.fault(256, i + 1)
+		self.assertRaises(m16c.FlasherException, flasher.page_read, 0x0f0100)
+		self.assertEqual(flasher.retry_count()['page_read'], 2)
+
+	def test_write_retry(self):
+		# The status after the write is lost, the page is written
+		# again, which leaves the same content.
+		(flasher, device) = flasher_open(retries=1, retry_delay=0)
+		device.fault(2, 2)
+		flasher.page_write(0x0f0000, 'a' * 256)
+		self.assertEqual(flasher.retry_count()['page_write'], 1)
+		self.assertEqual(flasher.page_read(0x0f0000), 'a' * 256)
+
+class FlasherPagesReadTest(unittest.TestCase):
+	"""Pipelined page reads, in batches and lock-step."""
+
+	def setUp(self):
+		self.addrs = range(0x0f0000, 0x0f2000, 0x100)
+		self.pages = [(addr, chr((addr >> 8) & 0xff) * 256) for addr in self.addrs]
+
+	def test_batches(self):
+		for batch in (1, 3, 8, 64):
+			(flasher, device) = flasher_open(PAGES)
+			self.assertEqual(list(flasher.pages_read(self.addrs, batch)), self.pages)
+			self.assertEqual(flasher.retry_count()['page_batch'], 0)
+
+	def test_unaligned(self):
+		(flasher, device) = flasher_open(PAGES)
+		self.assertEqual(
+				list(flasher.pages_read([0x0f0010, 0x0f01ff], 2)),
+				self.pages[:2]
+				)
+
+	def test_failed_batch(self):
+		# A short page in the second batch, the rest of the batch is
+		# drained and everything from there on is read lock-step.
+		(flasher, device) = flasher_open(PAGES, 57600)
+		device.fault(256, 10, 0.1)
+		self.assertEqual(list(flasher.pages_read(self.addrs, 8)), self.pages)
+		self.assertEqual(flasher.retry_count()['page_batch'], 1)
+		self.assertEqual(flasher.retry_count()['page_read'], 0)
+
+	def test_cached(self):
+		(flasher, device) = flasher_open(PAGES)
+		flasher.cache_set(64)
+		flasher.page_read(0x0f0300)
+		self.assertEqual(list(flasher.pages_read(self.addrs, 8)), self.pages)
+		self.assertEqual(flasher.cache_hits(), 1)
+
+		# Everything is cached now.
+		self.assertEqual(list(flasher.pages_read(self.addrs, 8)), self.pages)
+		self.assertEqual(flasher.cache_hits(), 1 + len(self.addrs))
+
+	def test_verify(self):
+		(flasher, device) = flasher_open(PAGES, 57600)
+		flasher.segment_verify(PAGES[0], 8)
+		try:
+			flasher.segment_verify((0x0f0000, 'x' * 0x200), 8)
+		except m16c.FlasherException:
+			pass
+		else:
+			self.fail('No error verifying different data.')
+
+	def test_invalid_batch(self):
+		(flasher, device) = flasher_open(PAGES)
+		self.assertRaises(m16c.FlasherException, flasher.pages_read, self.addrs, 0)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""Tests of the Intel HEX, ELF and raw binary loaders.
+
+Run from the top directory with:
+
+	python -m unittest discover -s tests"""
+
+import os, sys, struct, binascii, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import srec
+
+def ihex_record(record_type, addr, data, checksum=None):
+	"""An Intel HEX line, without the line ending."""
+
+	body = struct.pack('>BHB', len(data), addr, record_type) + data
+	if checksum == None:
+		checksum = -sum(bytearray(body)) & 0xff
+	return ':%s%02X' % (binascii.hexlify(body).upper(), checksum)
+
+def elf(segments, elf_class=1, endian='<'):
+	"""An ELF file with one program header per (type, paddr, data)."""
+
+	if elf_class == 1:
+		(header, ph_fmt) = (endian + 'HHIIIIIHHHHHH', endian + 'IIIIIIII')
+	else:
+		(header, ph_fmt) = (endian + 'HHIQQQIHHHHHH', endian + 'IIQQQQQQ')
+	ph_off = 16 + struct.calcsize(header)
+	ph_size = struct.calcsize(ph_fmt)
+
+	ident = '\x7fELF' + chr(elf_class) + chr({'<': 1, '>': 2}[endian]) + '\x01' + '\x00' * 9
+	data = ident + struct.pack(
+			header, 2, 0, 1, 0, ph_off, 0, 0,
+			16 + struct.calcsize(header), ph_size, len(segments), 0, 0, 0
+			)
+
+	offset = ph_off + ph_size * len(segments)
+	for (p_type, paddr, content) in segments:
+		if elf_class == 1:
+			data += struct.pack(ph_fmt, p_type, offset, paddr + 0x100000, paddr,
+					len(content), len(content), 5, 4)
+		else:
+			data += struct.pack(ph_fmt, p_type, 5, offset, paddr + 0x100000, paddr,
+					len(content), len(content), 4)
+		offset += len(content)
+	return data + ''.join([content for (p_type, paddr, content) in segments])
+
+class ImageFileTest(unittest.TestCase):
+	"""Loading and detecting each image format."""
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def write(self, name, data):
+		path = os.path.join(self.directory, name)
+		file = open(path, 'wb')
+		try:
+			file.write(data)
+		finally:
+			file.close()
+		return path
+
+	def assertImageError(self, path, format, message):
+		try:
+			srec.image_open(path, format)
+		except Exception, (error):
+			self.assertEqual(str(error), message)
+		else:
+			self.fail('No error for \'%s\'.' % path)
+
+	def test_ihex(self):
+		path = self.write('test.hex', '\r\n'.join([
+				ihex_record(0x00, 0x0000, 'low'),
+				ihex_record(0x04, 0x0000, '\x00\x0f'),
+				ihex_record(0x00, 0x0000, 'abcd'),
+				ihex_record(0x00, 0x0004, 'efgh'),
+				ihex_record(0x02, 0x0000, '\xff\x00'),
+				ihex_record(0x00, 0x0010, 'seg'),
+				ihex_record(0x05, 0x0000, '\x00\x0f\x00\x00'),
+				ihex_record(0x01, 0x0000, ''),
+				ihex_record(0x00, 0x0100, 'after the end'),
+				]) + '\r\n')
+
+		self.assertEqual(srec.image_format(path), 'ihex')
+		self.assertEqual(srec.image_open(path).segments(), [
+				(0x000000, 'low'),
+				(0x0f0000, 'abcdefgh'),
+				(0x0ff010, 'seg'),
+				])
+
+	def test_ihex_errors(self):
+		for (lines, message) in (
+				([ihex_record(0x00, 0, 'a', 0)], 'Line 1: Invalid checksum in record.'),
+				(['', 'x'], 'Line 2: Invalid record found.'),
+				([':0'], 'Line 1: Invalid hex digits in record.'),
+				([':00000001'], 'Line 1: Invalid length in record.'),
+				([ihex_record(0x00, 0, 'a'), ihex_record(0x00, 0, 'b')],
+				'Line 2: Duplicate address in Intel HEX file.'),
+				([ihex_record(0x06, 0, '')], 'Line 1: Invalid record type: 06.'),
+				([ihex_record(0x04, 0, '\x00')], 'Line 1: Invalid extended address record.'),
+				([ihex_record(0x01, 0, '')], 'Intel HEX file contained no data segments.'),
+				):
+			path = self.write('error.hex', '\n'.join(lines) + '\n')
+			self.assertImageError(path, 'ihex', message)
+
+	def test_elf(self):
+		segments = [
+				(1, 0x0f0000, 'text'),
+				(1, 0x0f0004, 'data'),
+				(1, 0x000400, ''),
+				(4, 0x0f8000, 'note'),
+				(1, 0x0ff000, 'vectors'),
+				]
+		for (elf_class, endian) in ((1, '<'), (1, '>'), (2, '<'), (2, '>')):
+			path = self.write('test.elf', elf(segments, elf_class, endian))
+			self.assertEqual(srec.image_format(path), 'elf')
+
+			# Only loadable segments with content, at their load address.
+			self.assertEqual(srec.image_open(path).segments(), [
+					(0x0f0000, 'textdata'),
+					(0x0ff000, 'vectors'),
+					])
+
+	def test_elf_errors(self):
+		valid = elf([(1, 0x0f0000, 'text')])
+		for (data, message) in (
+				('\x7fELF', 'ELF file too short (4).'),
+				(valid[:5] + '\x03' + valid[6:], 'Invalid ELF data encoding (3).'),
+				(valid[:4] + '\x03' + valid[5:], 'Invalid ELF class (3).'),
+				(valid[:-1], 'ELF segment 0 out of range.'),
+				(elf([(4, 0x0f0000, 'note')]), 'ELF file contained no loadable segments.'),
+				):
+			path = self.write('error.elf', data)
+			self.assertImageError(path, 'elf', message)
+		self.assertImageError(self.write('error.elf', 'text'), 'elf', 'Not an ELF file.')
+
+	def test_bin(self):
+		path = self.write('test.bin', 'binary')
+		self.assertEqual(srec.image_format(path), 'bin')
+		self.assertEqual(srec.image_open(path, 'bin', 0x0f0000).segments(), [(0x0f0000, 'binary')])
+		self.assertEqual(srec.image_open(self.write('empty.bin', '')).segments(), [])
+
+	def test_format(self):
+		path = self.write('test.img', 'binary')
+		self.assertImageError(
+				path, 'auto',
+				'Unable to determine the format of \'%s\', please specify it.' % path
+				)
+		self.assertImageError(path, 'coff', 'Invalid image format \'coff\'.')
+		self.assertEqual(srec.image_open(path, 'bin').segments(), [(0, 'binary')])
+
+if __name__ == '__main__':
+	unittest.main()
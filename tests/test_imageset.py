@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""Tests of images combined from several files.
+
+Run from the top directory with:
+
+	python -m unittest discover -s tests"""
+
+import os, sys, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import srec
+
+class ImageSetTest(unittest.TestCase):
+	"""Images of different formats combined into one."""
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def write(self, name, data):
+		path = os.path.join(self.directory, name)
+		file = open(path, 'wb')
+		try:
+			file.write(data)
+		finally:
+			file.close()
+		return path
+
+	def test_shared_and_binary(self):
+		# The shared image segments are buffers, merging them with the
+		# adjacent binary image must give plain data.
+		shared = os.path.join(self.directory, 'shared.img')
+		srec.image_publish([(0x0f0000, 'A' * 0x100), (0x0f0200, 'C' * 0x10)], shared)
+		binary = self.write('binary.bin', 'B' * 0x100)
+
+		image = srec.ImageSet([
+				(shared, 'auto', 0),
+				(binary, 'bin', 0x0f0100),
+				])
+		self.assertEqual(
+				[(addr, str(data)) for (addr, data) in image.segments()],
+				[(0x0f0000, 'A' * 0x100 + 'B' * 0x100 + 'C' * 0x10)]
+				)
+
+	def test_overlap(self):
+		shared = os.path.join(self.directory, 'shared.img')
+		srec.image_publish([(0x0f0000, 'A' * 0x100)], shared)
+		binary = self.write('binary.bin', 'B' * 0x100)
+
+		try:
+			srec.ImageSet([(shared, 'auto', 0), (binary, 'bin', 0x0f00ff)])
+		except srec.ImageException, (error):
+			self.assertEqual(
+					str(error),
+					'\'%s\' and \'%s\' overlap at 0x0f00ff.' % (shared, binary)
+					)
+		else:
+			self.fail('No error for overlapping images.')
+
+if __name__ == '__main__':
+	unittest.main()
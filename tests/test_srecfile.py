@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""Tests of the S-Record parser, behaviour and budgets.
+
+Run from the top directory with:
+
+	python -m unittest discover -s tests"""
+
+import os, sys, time, shutil, struct, binascii, tempfile, unittest, subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import srec
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+# Budgets for the large input, per megabyte of S-Record file. Parsing
+# currently takes about 0.1s/MB and peaks at about four times the size
+# of the file.
+TIME_PER_MB = 0.5
+MEMORY_PER_FILE_SIZE = 6
+
+def record(record_type, addr, data, checksum=None):
+	"""A S-Record line, without the line ending."""
+
+	addr_len = {
+			'0': 2, '1': 2, '2': 3, '3': 4, '5': 2, '7': 4, '8': 3, '9': 2
+			}[record_type]
+	body = struct.pack('>BI', addr_len + len(data) + 1, addr)
+	body = body[:1] + body[5-addr_len:] + data
+	if checksum == None:
+		checksum = ~sum(bytearray(body)) & 0xff
+	return 'S%s%s%02X' % (record_type, binascii.hexlify(body).upper(), checksum)
+
+# Without tracemalloc the file is parsed in a child process. The peak of
+# RUSAGE_CHILDREN covers every child ever waited for, so a fresh process
+# runs the children: first one only importing srec, to take the
+# interpreter itself out, then the one parsing the file.
+MEMORY_CHILDREN = """
+import sys, subprocess, resource
+for code in ('', "srec.SRecFile(%r).segments()"):
+	if subprocess.call([sys.executable, '-c', "import sys; sys.path.insert(0, %r); import srec; " + code]) != 0:
+		sys.exit(1)
+	print resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+"""
+
+def child_peak_memory(path):
+	"""Peak memory in bytes of parsing path in a child process, None
+	if the child failed."""
+
+	top = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+	child = subprocess.Popen(
+			[sys.executable, '-c', MEMORY_CHILDREN % (path, top)],
+			stdout=subprocess.PIPE
+			)
+	output = child.communicate()[0]
+	if child.returncode != 0:
+		return None
+
+	# Kilobytes on Linux, bytes on Mac OS X.
+	(baseline, peak) = [int(i) for i in output.split()]
+	if sys.platform != 'darwin':
+		return (peak - baseline) * 1024
+	return peak - baseline
+
+class SRecFileTest(unittest.TestCase):
+	"""Edge cases, parsed both as lines and from a path."""
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def parse(self, text):
+		"""Parse text both ways, they must agree."""
+
+		path = os.path.join(self.directory, 'test.s')
+		file = open(path, 'wb')
+		try:
+			file.write(text)
+		finally:
+			file.close()
+
+		segments = srec.SRecFile(path).segments()
+		lines = text.splitlines(True)
+		self.assertEqual(srec.SRecFile(lines).segments(), segments)
+		return segments
+
+	def assertParseError(self, text, message):
+		"""Both ways must fail with the message."""
+
+		path = os.path.join(self.directory, 'test.s')
+		file = open(path, 'wb')
+		try:
+			file.write(text)
+		finally:
+			file.close()
+
+		for source in (path, text.splitlines(True)):
+			try:
+				srec.SRecFile(source)
+			except srec.SRecException, (error):
+				self.assertEqual(str(error), message)
+			else:
+				self.fail('No error for %r.' % text)
+
+	def test_line_endings(self):
+		for ending in ('\n', '\r\n', '\r'):
+			text = ending.join([
+					record('0', 0, 'hdr'),
+					record('1', 0x1000, 'abcd'),
+					record('1', 0x1004, 'efgh'),
+					record('9', 0, ''),
+					]) + ending
+			self.assertEqual(self.parse(text), [(0x1000, 'abcdefgh')])
+
+	def test_last_line_without_ending(self):
+		text = record('1', 0x1000, 'abcd') + '\r\n' + record('9', 0, '')
+		self.assertEqual(self.parse(text), [(0x1000, 'abcd')])
+
+		text = record('1', 0x1000, 'abcd')
+		self.assertEqual(self.parse(text), [(0x1000, 'abcd')])
+
+	def test_mixed_line_endings(self):
+		text = record('1', 0x1000, 'abcd') + '\r\n' + \
+				record('1', 0x1004, 'efgh') + '\n' + \
+				record('9', 0, '') + '\r\n'
+		self.assertParseError(text, 'Line 2: Inconsistant line endings in S-Record.')
+
+	def test_header(self):
+		text = record('0', 0, 'header') + '\n' + record('1', 0, 'x') + '\n'
+		self.assertEqual(self.parse(text), [(0, 'x')])
+
+		# Without any header text.
+		text = record('0', 0, '') + '\n' + record('1', 0, 'x') + '\n'
+		self.assertEqual(self.parse(text), [(0, 'x')])
+
+	def test_header_not_first(self):
+		text = record('1', 0, 'x') + '\n' + record('0', 0, 'header') + '\n'
+		self.assertParseError(text, 'Line 2: Header record not on the first line.')
+
+	def test_header_bad_checksum(self):
+		text = record('0', 0, 'header', 0) + '\n' + record('1', 0, 'x') + '\n'
+		self.assertParseError(text, 'Line 1: Invalid checksum in S-Record.')
+
+	def test_termination_records(self):
+		for (data_type, end_type, addr) in (
+				('1', '9', 0x1234),
+				('2', '8', 0x123456),
+				('3', '7', 0x12345678),
+				):
+			text = record(data_type, addr, 'data') + '\n' + record(end_type, 0, '') + '\n'
+			self.assertEqual(self.parse(text), [(addr, 'data')])
+
+	def test_invalid_record_type(self):
+		text = record('1', 0, 'x') + '\n' + record('5', 1, '') + '\n'
+		self.assertParseError(text, 'Line 2: Invalid record type: \'S5\'.')
+
+		text = record('1', 0, 'x') + '\nX1\n'
+		self.assertParseError(text, 'Line 2: Invalid record found')
+
+	def test_duplicate_address(self):
+		text = '\n'.join([
+				record('1', 0x1000, 'abcd'),
+				record('1', 0x2000, 'efgh'),
+				record('1', 0x1000, 'ijkl'),
+				]) + '\n'
+		self.assertParseError(text, 'Line 3: Duplicate address in S-Record file.')
+
+	def test_bad_checksum(self):
+		text = '\n'.join([
+				record('1', 0x1000, 'abcd'),
+				record('1', 0x1004, 'efgh', 0x42),
+				]) + '\n'
+		self.assertParseError(text, 'Line 2: Invalid checksum in S-Record.')
+
+	def test_bad_length(self):
+		line = record('1', 0x1000, 'abcd')
+		text = line[:-2] + '00' + line[-2:] + '\n'
+		self.assertParseError(text, 'Line 1: Invalid length in S-Record.')
+
+	def test_bad_hex(self):
+		line = record('1', 0x1000, 'abcd')
+		text = line[:10] + 'XY' + line[12:] + '\n'
+		self.assertParseError(text, 'Line 1: Invalid data entry in S-Record.')
+
+	def test_data_record_without_data(self):
+		text = record('1', 0x1000, '') + '\n'
+		self.assertParseError(text, 'Line 1: S-Record too short (8).')
+
+	def test_non_contiguous(self):
+		# Out of order and with a gap, the segments come out sorted and
+		# only the consecutive records are merged.
+		text = '\n'.join([
+				record('2', 0x0f8000, 'second'),
+				record('2', 0x0f0004, 'efgh'),
+				record('2', 0x0f0000, 'abcd'),
+				record('2', 0x0f0010, 'gap'),
+				]) + '\n'
+		self.assertEqual(self.parse(text), [
+				(0x0f0000, 'abcdefgh'),
+				(0x0f0010, 'gap'),
+				(0x0f8000, 'second'),
+				])
+
+	def test_no_data(self):
+		text = record('0', 0, 'header') + '\n' + record('9', 0, '') + '\n'
+		self.assertParseError(text, 'S-Record file contained no data segments.')
+		self.assertParseError('', 'S-Record file contained no data segments.')
+
+	def test_parallel(self):
+		# Parse a small file with the parallel parser, it must find the
+		# same segments and report errors on the same line.
+		module = sys.modules['srec.SRecFile']
+		parallel_size = module.PARALLEL_SIZE
+		module.PARALLEL_SIZE = 0
+		try:
+			lines = [record('2', 0x0f0000 + 16*i, chr(i) * 16) for i in range(256)]
+			path = os.path.join(self.directory, 'parallel.s')
+			for (text, error) in (
+					('\r\n'.join(lines) + '\r\n', None),
+					('\r\n'.join(lines + [lines[100]]) + '\r\n',
+					'Line 257: Duplicate address in S-Record file.'),
+					):
+				file = open(path, 'wb')
+				try:
+					file.write(text)
+				finally:
+					file.close()
+
+				if error == None:
+					self.assertEqual(
+							srec.SRecFile(path, 2).segments(),
+							srec.SRecFile(path, 1).segments()
+							)
+				else:
+					try:
+						srec.SRecFile(path, 2)
+					except srec.SRecException, (e):
+						self.assertEqual(str(e), error)
+					else:
+						self.fail('No error from the parallel parser.')
+		finally:
+			module.PARALLEL_SIZE = parallel_size
+
+class SRecFileBudgetTest(unittest.TestCase):
+	"""Parse time and peak memory of a large generated file."""
+
+	@classmethod
+	def setUpClass(cls):
+		cls.directory = tempfile.mkdtemp()
+		cls.path = os.path.join(cls.directory, 'large.s')
+
+		# 1MB of data in 32 byte S2 records, two segments.
+		data = ''.join([chr(i & 0xff) * 32 for i in range(0x8000)])
+		file = open(cls.path, 'wb')
+		try:
+			file.write(record('0', 0, 'large') + '\r\n')
+			for base in (0x000000, 0x100000):
+				file.write(''.join([
+						record('2', base + i, data[i:i+32]) + '\r\n'
+						for i in range(0, len(data) / 2, 32)
+						]))
+			file.write(record('9', 0, '') + '\r\n')
+		finally:
+			file.close()
+		cls.size = os.path.getsize(cls.path)
+		cls.data = data[:len(data) / 2]
+
+	@classmethod
+	def tearDownClass(cls):
+		shutil.rmtree(cls.directory)
+
+	def test_result(self):
+		self.assertEqual(
+				srec.SRecFile(self.path).segments(),
+				[(0x000000, self.data), (0x100000, self.data)]
+				)
+
+	def test_parse_time(self):
+		# Best of three, to keep other load on the machine out of it.
+		best = None
+		for i in range(3):
+			start = time.time()
+			srec.SRecFile(self.path)
+			elapsed = time.time() - start
+			if best == None or elapsed < best:
+				best = elapsed
+
+		budget = TIME_PER_MB * self.size / float(1 << 20)
+		self.assertTrue(
+				best <= budget,
+				'Parsing took %.3fs, the budget is %.3fs.' % (best, budget)
+				)
+
+	@unittest.skipIf(
+			tracemalloc == None and resource == None,
+			'Neither tracemalloc nor resource is available.'
+			)
+	def test_peak_memory(self):
+		if tracemalloc != None:
+			tracemalloc.start()
+			try:
+				segments = srec.SRecFile(self.path).segments()
+				(current, peak) = tracemalloc.get_traced_memory()
+			finally:
+				tracemalloc.stop()
+		else:
+			peak = child_peak_memory(self.path)
+			self.assertNotEqual(peak, None, 'Parsing in a child process failed.')
+
+		budget = MEMORY_PER_FILE_SIZE * self.size
+		self.assertTrue(
+				peak <= budget,
+				'Parsing peaked at %d bytes, the budget is %d.' % (peak, budget)
+				)
+
+if __name__ == '__main__':
+	unittest.main()
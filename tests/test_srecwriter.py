@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""Tests of the S-Record writer and of indexed access to what it writes.
+
+Run from the top directory with:
+
+	python -m unittest discover -s tests"""
+
+import os, sys, shutil, tempfile, unittest, StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import srec
+
+DATA = ''.join([chr(i & 0xff) * 3 for i in range(0x1000)])
+
+def srec_write(segments, **kwargs):
+	"""The segments written as S-Records, returns the text."""
+
+	file = StringIO.StringIO()
+	writer = srec.SRecWriter(file, **kwargs)
+	for (addr, data) in segments:
+		writer.write(addr, data)
+	writer.close()
+	return file.getvalue()
+
+class SRecWriterTest(unittest.TestCase):
+	"""What is written parses back to the same segments."""
+
+	def test_round_trip(self):
+		segments = [(0x0000, DATA[:0x100]), (0x8000, DATA[:0x123])]
+		for addr_len in (2, 3, 4):
+			text = srec_write(segments, addr_len=addr_len, header='test')
+			lines = text.splitlines(True)
+			self.assertTrue(lines[0].startswith('S0'))
+			self.assertTrue(lines[-1].startswith('S%d' % (11 - addr_len)))
+			self.assertEqual(srec.SRecFile(lines).segments(), segments)
+
+	def test_record_size(self):
+		text = srec_write([(0x0f0000, DATA[:100])], record_size=16)
+		self.assertEqual(len(text.splitlines()), 1 + 7 + 1)
+
+	def test_line_ending(self):
+		text = srec_write([(0x0f0000, DATA[:100])], line_ending='\n')
+		self.assertEqual(text.count('\n'), 6)
+		self.assertEqual(text.count('\r'), 0)
+
+	def test_errors(self):
+		for (kwargs, message) in (
+				({'addr_len': 1}, 'Invalid address length of S-Record.'),
+				({'record_size': 0}, 'Invalid S-Record size (0).'),
+				({'addr_len': 4, 'record_size': 251}, 'Invalid S-Record size (251).'),
+				):
+			try:
+				srec.SRecWriter(StringIO.StringIO(), **kwargs)
+			except srec.SRecException, (error):
+				self.assertEqual(str(error), message)
+			else:
+				self.fail('No error for %r.' % kwargs)
+
+		writer = srec.SRecWriter(StringIO.StringIO(), addr_len=2)
+		try:
+			writer.write(0xffff, 'ab')
+		except srec.SRecException, (error):
+			self.assertEqual(str(error), 'Address 0xffff out of range for S1 records.')
+		else:
+			self.fail('No error for data beyond the address range.')
+
+class SRecIndexTest(unittest.TestCase):
+	"""Indexed access to written S-Record files."""
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, 'test.s')
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def write(self, text):
+		file = open(self.path, 'wb')
+		try:
+			file.write(text)
+		finally:
+			file.close()
+
+	def test_round_trip(self):
+		segments = [(0x0f0000, DATA), (0x0fe000, DATA[:0x200])]
+		for line_ending in ('\r\n', '\n', '\r'):
+			self.write(srec_write(segments, line_ending=line_ending))
+			if os.path.exists(self.path + '.idx'):
+				os.unlink(self.path + '.idx')
+
+			index = srec.SRecIndex(self.path, group=8)
+			self.assertNotEqual(len(index.ranges()), 0)
+			self.assertEqual(
+					index.segments(0x0f0100, 0x1000),
+					[(0x0f0100, DATA[0x100:0x1100])]
+					)
+			self.assertEqual(
+					index.segments(0x0f2f00, 0xb200),
+					[(0x0f2f00, DATA[0x2f00:]), (0x0fe000, DATA[:0x100])]
+					)
+
+	def test_saved_index(self):
+		self.write(srec_write([(0x0f0000, DATA)]))
+		ranges = srec.SRecIndex(self.path, group=8).ranges()
+		self.assertTrue(os.path.exists(self.path + '.idx'))
+
+		# The saved index is used as it is, whatever the group size.
+		index = srec.SRecIndex(self.path, group=64)
+		self.assertEqual(index.ranges(), ranges)
+		self.assertEqual(index.segments(0x0f0000, 0x10), [(0x0f0000, DATA[:0x10])])
+
+	def test_no_data_in_range(self):
+		self.write(srec_write([(0x0f0000, DATA[:0x100])]))
+		index = srec.SRecIndex(self.path)
+		for (addr, size, message) in (
+				(0x0e0000, 0x100, 'No S-Record data within 0x0e0000-0x0e00ff.'),
+				(0x0f0000, 0, 'Invalid range size (0).'),
+				):
+			try:
+				index.segments(addr, size)
+			except srec.SRecException, (error):
+				self.assertEqual(str(error), message)
+			else:
+				self.fail('No error for 0x%06x:0x%x.' % (addr, size))
+
+if __name__ == '__main__':
+	unittest.main()
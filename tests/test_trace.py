@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+#
+#    Simple Flasher is a serial line flashing application for Renesas M16C
+#    16-bit single-chip microcomputer.
+#
+#    Copyright (C) 2007  Simon Aittamaa <simait-2@student.ltu.se>.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""Tests of serial traces and their replay.
+
+Run from the top directory with:
+
+	python -m unittest discover -s tests"""
+
+import os, sys, struct, unittest, StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import m16c
+
+def session(device):
+	"""A short flashing session, returns the page read at the end."""
+
+	flasher = m16c.Flasher(device, True)
+	flasher.baud_set(57600)
+	flasher.id_validate([0] * 7)
+	flasher.page_write(0x0f0000, 'a' * 256)
+	return flasher.page_read(0x0f0000)
+
+class TraceTest(unittest.TestCase):
+	"""Recording a session against PlanDevice and replaying it."""
+
+	def setUp(self):
+		self.file = StringIO.StringIO()
+		self.device = m16c.TraceDevice(m16c.PlanDevice(), self.file)
+		self.page = session(self.device)
+
+	def test_record(self):
+		self.assertEqual(self.page, 'a' * 256)
+
+		events = self.device.events()
+		self.assertEqual(events[0][0], 'W')
+		self.assertEqual(events[0][4], '\xb3')
+		self.assertEqual(events[2][:1] + events[2][3:], ('B', 57600, ''))
+		self.assertEqual(m16c.trace_load(StringIO.StringIO(self.file.getvalue())), events)
+
+	def test_commands(self):
+		commands = m16c.trace_commands(self.device.events())
+		self.assertEqual(
+				[(name, written, read) for (name, start, duration, written, read) in commands],
+				[
+					('baud_set', 1, 1),
+					('id_validate', 12, 0),
+					('status_read', 1, 2),
+					('status_read', 1, 2),
+					('status_read', 1, 2),
+					('page_write', 259, 0),
+					('status_read', 1, 2),
+					('status_read', 1, 2),
+					('status_read', 1, 2),
+					('page_read', 3, 256),
+					('status_read', 1, 2),
+				])
+
+		summary = m16c.trace_summary(commands)
+		self.assertEqual(summary['status_read'][0], 7)
+
+	def test_replay(self):
+		replay = m16c.ReplayDevice(self.device.events())
+		self.assertEqual(session(replay), 'a' * 256)
+		self.assertTrue(replay.done())
+
+	def test_replay_diverged(self):
+		replay = m16c.ReplayDevice(self.device.events())
+		flasher = m16c.Flasher(replay, True)
+		flasher.baud_set(57600)
+		try:
+			flasher.id_validate([1] * 7)
+		except m16c.TraceException, (error):
+			self.assertEqual(str(error), 'Replay diverged at event 3.')
+		else:
+			self.fail('No error for a diverged replay.')
+
+		replay = m16c.ReplayDevice(self.device.events()[:1])
+		try:
+			m16c.Flasher(replay, True).baud_set(57600)
+		except m16c.TraceException, (error):
+			self.assertEqual(str(error), 'Replay diverged: trace ended at event 1.')
+		else:
+			self.fail('No error for a replay beyond the trace.')
+
+	def test_load_errors(self):
+		trace = self.file.getvalue()
+		for (data, message) in (
+				('', 'Trace too short (0).'),
+				('x' * 17, 'Not a trace file.'),
+				(trace[:8] + '\x02' + trace[9:], 'Unsupported trace version (2).'),
+				(trace[:20], 'Truncated trace at offset 17.'),
+				):
+			try:
+				m16c.trace_load(StringIO.StringIO(data))
+			except m16c.TraceException, (error):
+				self.assertEqual(str(error), message)
+			else:
+				self.fail('No error for %r.' % data)
+
+	def test_report(self):
+		report = m16c.trace_report(self.device.events(), self.device.events())
+		self.assertEqual(report.splitlines()[0].split(), [
+				'Command', 'Count', 'Mean', 'Count', 'Mean', 'Delta'
+				])
+		self.assertEqual(len(report.splitlines()), 1 + 5)
+
+if __name__ == '__main__':
+	unittest.main()